@@ -10,7 +10,7 @@ import traceback
 import xml.etree.ElementTree as ET
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, Optional
+from typing import Iterable, Optional, Union
 
 from .diagramagic import DiagramagicSemanticError, FocusNotFoundError, diagramagic, render_png
 from .resources import load_cheatsheet, load_patterns, load_prompt, load_skill
@@ -32,6 +32,19 @@ class UsageError(Exception):
     pass
 
 
+@dataclass
+class CompileCommand:
+    """Pre-parsed ``compile`` invocation; mirrors the argparse namespace."""
+
+    input: Optional[str] = None
+    text: Optional[str] = None
+    stdout: bool = False
+    output: Optional[str] = None
+    templates: Optional[list[str]] = None
+    error_format: str = "text"
+    debug: bool = False
+
+
 class FriendlyArgumentParser(argparse.ArgumentParser):
     def error(self, message: str) -> None:  # pragma: no cover - argparse callback
         raise UsageError(message)
@@ -275,7 +288,15 @@ def _emit_error(err: CliError, *, error_format: str) -> None:
         sys.stderr.write(f"hint: {err.hint}\n")
 
 
-def _handle_compile(args: argparse.Namespace) -> int:
+def _report_exception(exc: Exception, *, error_format: str, debug: bool) -> int:
+    err = _error_from_exception(exc)
+    _emit_error(err, error_format=error_format)
+    if debug:
+        traceback.print_exc(file=sys.stderr)
+    return err.exit_code
+
+
+def _handle_compile(args: Union[argparse.Namespace, CompileCommand]) -> int:
     if args.stdout and args.output:
         raise CliError(
             "E_ARGS",
@@ -356,9 +377,21 @@ def _handle_render(args: argparse.Namespace) -> int:
     return 0
 
 
-def main(argv: Optional[Iterable[str]] = None) -> int:
+def execute_compile(cmd: CompileCommand) -> int:
+    """Run ``compile`` without going through argparse; returns the exit code."""
+    try:
+        return _handle_compile(cmd)
+    except Exception as exc:  # pragma: no cover - exercised in integration tests
+        return _report_exception(exc, error_format=cmd.error_format, debug=cmd.debug)
+
+
+def main(
+    argv: Optional[Iterable[str]] = None,
+    parser: Optional[argparse.ArgumentParser] = None,
+) -> int:
     raw_argv = list(argv) if argv is not None else sys.argv[1:]
-    parser = _build_parser()
+    if parser is None:
+        parser = _build_parser()
 
     if not raw_argv:
         err = CliError(
@@ -382,7 +415,17 @@ def main(argv: Optional[Iterable[str]] = None) -> int:
         error_format = args.error_format
 
         if args.command == "compile":
-            return _handle_compile(args)
+            return execute_compile(
+                CompileCommand(
+                    input=args.input,
+                    text=args.text,
+                    stdout=args.stdout,
+                    output=args.output,
+                    templates=args.templates,
+                    error_format=error_format,
+                    debug=debug_enabled,
+                )
+            )
         if args.command == "render":
             return _handle_render(args)
         if args.command == "cheatsheet":
@@ -414,11 +457,7 @@ def main(argv: Optional[Iterable[str]] = None) -> int:
         _emit_error(err, error_format=error_format)
         return err.exit_code
     except Exception as exc:  # pragma: no cover - exercised in integration tests
-        err = _error_from_exception(exc)
-        _emit_error(err, error_format=error_format)
-        if debug_enabled:
-            traceback.print_exc(file=sys.stderr)
-        return err.exit_code
+        return _report_exception(exc, error_format=error_format, debug=debug_enabled)
 
 
 if __name__ == "__main__":
@@ -3,14 +3,16 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 import math
+import os
 import re
 import shlex
 import shutil
 import subprocess
 import xml.etree.ElementTree as ET
-from copy import deepcopy
+from collections import Counter
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
 
 try:
     from diagramagic._diagramagic_resvg import measure_svg as _measure_svg
@@ -45,9 +47,38 @@ GENERIC_FONT_FALLBACKS = {
     ],
 }
 
+# CSS generic family keywords that cannot substring-match a font file name.
+# emoji/math/fangsong are left out on purpose: they resolve to files such as
+# NotoColorEmoji.ttf or *Math*.ttf through the normal lookup.
+_CSS_GENERIC_FAMILIES = frozenset(
+    {
+        "cursive",
+        "fantasy",
+        "system-ui",
+        "ui-sans-serif",
+        "ui-serif",
+        "ui-monospace",
+        "ui-rounded",
+    }
+)
+
 GRAPH_MAX_NODES = 2000
 GRAPH_MAX_EDGES = 8000
 
+_CSS_RULE_RE = re.compile(r"([^{}]+)\{([^{}]*)\}", re.MULTILINE)
+_CSS_CLASS_RE = re.compile(r"\.([A-Za-z_][A-Za-z0-9_-]*)")
+_FONT_FAMILY_STYLE_RE = re.compile(r"font-family:\s*([^;]+)")
+_FONT_SIZE_STYLE_RE = re.compile(r"font-size:\s*([0-9.]+)")
+_TRANSFORM_FUNCTION_RE = re.compile(r"([a-zA-Z]+)\s*\(([^)]*)\)")
+_TRANSFORM_ARG_SPLIT_RE = re.compile(r"[,\s]+")
+_LENGTH_RE = re.compile(r"^-?\d+(?:\.\d+)?")
+_FONT_NAME_SEPARATOR_RE = re.compile(r"[^a-z0-9]+", re.IGNORECASE)
+_WHITESPACE_SPLIT_RE = re.compile(r"(\s+)")
+
+_FLEX_CONSUMED_ATTRS = frozenset(
+    {"x", "y", "width", "direction", "gap", "padding", "background-class", "background-style"}
+)
+
 
 class FocusNotFoundError(ValueError):
     """Raised when a requested focus id does not exist in rendered SVG."""
@@ -146,38 +177,31 @@ class _TextMeasurer:
         Path("/usr/local/share/fonts"),
         Path("C:/Windows/Fonts"),
     ]
+    WIDTH_CACHE_SIZE = 10_000
 
     def __init__(self) -> None:
         self._font_cache: dict[Tuple[str, int], Optional["ImageFont.FreeTypeFont"]] = {}
         self._font_paths: dict[str, Optional[str]] = {}
+        self._font_index: Optional[List[Tuple[str, str]]] = None
+        self._width_cache: dict[Tuple["ImageFont.ImageFont", str], float] = {}
+        self._metrics_cache: dict[
+            Tuple[str, float], Tuple[float, float, float]
+        ] = {}
 
     def font(
         self, size: float, family: Optional[str], explicit_path: Optional[str]
     ) -> Optional["ImageFont.ImageFont"]:
         if ImageFont is None:
             return None
-        key_size = max(1, int(round(size)))
-        if family is None:
-            family = DEFAULT_FONT_FAMILY
-        key_family = (explicit_path or family).lower()
-        cache_key = (key_family, key_size)
+        cache_key = self._font_key(size, family, explicit_path)
         if cache_key in self._font_cache:
             return self._font_cache[cache_key]
+        key_size = cache_key[1]
+        if family is None:
+            family = DEFAULT_FONT_FAMILY
 
         font: Optional["ImageFont.ImageFont"] = None
-        candidates: List[str] = []
-        if explicit_path:
-            candidates.append(explicit_path)
-        if family:
-            family_key = family.lower()
-            mapped_families = GENERIC_FONT_FALLBACKS.get(family_key, [family])
-            for fam in mapped_families:
-                resolved = self._locate_font(fam)
-                if resolved:
-                    candidates.append(resolved)
-        candidates.append("DejaVuSans.ttf")
-
-        for candidate in candidates:
+        for candidate in self._font_candidates(family, explicit_path):
             try:
                 path, index = self._parse_font_candidate(candidate)
                 font = ImageFont.truetype(path, key_size, index=index)
@@ -193,17 +217,50 @@ class _TextMeasurer:
         self._font_cache[cache_key] = font
         return font
 
+    @staticmethod
+    def _font_key(
+        size: float, family: Optional[str], explicit_path: Optional[str]
+    ) -> Tuple[str, int]:
+        """Cache key shared by every lookup: (lowercased family or path, rounded size)."""
+        if family is None:
+            family = DEFAULT_FONT_FAMILY
+        return (explicit_path or family).lower(), max(1, int(round(size)))
+
+    def _font_candidates(
+        self, family: str, explicit_path: Optional[str]
+    ) -> Iterator[str]:
+        """Yield font files to try in order, resolving families only on demand."""
+        if explicit_path:
+            yield explicit_path
+        if family:
+            family_key = family.lower()
+            for fam in GENERIC_FONT_FALLBACKS.get(family_key, [family]):
+                resolved = self._locate_font(fam)
+                if resolved:
+                    yield resolved
+        yield "DejaVuSans.ttf"
+
     def measure(
         self, text: str, size: float, family: Optional[str], explicit_path: Optional[str]
     ) -> float:
         font = self.font(size, family, explicit_path)
         if font is None:
             return _heuristic_width(text, size)
+        # Fonts are cached per (family, rounded size), so the font object itself
+        # identifies everything the width depends on.
+        cache_key = (font, text)
+        cached = self._width_cache.get(cache_key)
+        if cached is not None:
+            return cached
         try:
             length = font.getlength(text)
         except AttributeError:
             length = font.getsize(text)[0]
-        return float(length)
+        width = float(length)
+        if len(self._width_cache) >= self.WIDTH_CACHE_SIZE:
+            self._width_cache.pop(next(iter(self._width_cache)))
+        self._width_cache[cache_key] = width
+        return width
 
     def line_height(
         self, size: float, family: Optional[str], explicit_path: Optional[str]
@@ -213,6 +270,19 @@ class _TextMeasurer:
 
     def metrics(
         self, size: float, family: Optional[str], explicit_path: Optional[str]
+    ) -> Tuple[float, float, float]:
+        # Keyed on the unrounded size: the line height scales with it even
+        # though the font object is shared across nearby sizes.
+        cache_key = (self._font_key(size, family, explicit_path)[0], size)
+        cached = self._metrics_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        result = self._compute_metrics(size, family, explicit_path)
+        self._metrics_cache[cache_key] = result
+        return result
+
+    def _compute_metrics(
+        self, size: float, family: Optional[str], explicit_path: Optional[str]
     ) -> Tuple[float, float, float]:
         font = self.font(size, family, explicit_path)
         if font is None:
@@ -245,41 +315,25 @@ class _TextMeasurer:
         key = family.lower()
         if key in self._font_paths:
             return self._font_paths[key]
-        normalized = re.sub(r"[^a-z0-9]+", "", family, flags=re.IGNORECASE).lower()
+        if key in _CSS_GENERIC_FAMILIES:
+            self._font_paths[key] = None
+            return None
+        normalized = _FONT_NAME_SEPARATOR_RE.sub("", family).lower()
         aliases = {normalized, normalized + "mt", normalized + "psmt"}
         best_match: Optional[Tuple[int, str]] = None
-        for directory in self.FONT_DIRS:
-            if not directory.exists():
-                continue
-            try:
-                for glob in ("*.ttf", "*.ttc"):
-                    for path in directory.rglob(glob):
-                        stem = re.sub(
-                            r"[^a-z0-9]+", "", path.stem, flags=re.IGNORECASE
-                        ).lower()
-                        if not normalized:
-                            continue
-                        match_score = None
-                        if stem in aliases:
-                            match_score = 0
-                        elif stem.startswith(normalized):
-                            match_score = 1
-                        elif normalized in stem:
-                            match_score = 2
-                        if match_score is None:
-                            continue
-                        candidate = (
-                            str(path)
-                            if glob == "*.ttf"
-                            else f"{path};0"
-                        )
-                        if (
-                            best_match is None
-                            or match_score < best_match[0]
-                        ):
-                            best_match = (match_score, candidate)
-            except Exception:
-                continue
+        if normalized:
+            for stem, candidate in self._ensure_font_index():
+                if stem in aliases:
+                    best_match = (0, candidate)
+                    break
+                if stem.startswith(normalized):
+                    match_score = 1
+                elif normalized in stem:
+                    match_score = 2
+                else:
+                    continue
+                if best_match is None or match_score < best_match[0]:
+                    best_match = (match_score, candidate)
         if best_match:
             resolved = best_match[1]
             self._font_paths[key] = resolved
@@ -287,6 +341,47 @@ class _TextMeasurer:
         self._font_paths[key] = None
         return None
 
+    def _ensure_font_index(self) -> List[Tuple[str, str]]:
+        """Walk FONT_DIRS once, recording (normalized stem, candidate) in order."""
+        if self._font_index is not None:
+            return self._font_index
+        index: List[Tuple[str, str]] = []
+        for directory in self.FONT_DIRS:
+            if not directory.exists():
+                continue
+            ttc_entries: List[Tuple[str, str]] = []
+            try:
+                for name, path in self._walk_font_files(str(directory)):
+                    stem = _FONT_NAME_SEPARATOR_RE.sub("", name[:-4]).lower()
+                    if name.endswith(".ttf"):
+                        index.append((stem, path))
+                    else:
+                        ttc_entries.append((stem, f"{path};0"))
+            except Exception:
+                pass
+            index.extend(ttc_entries)
+        self._font_index = index
+        return index
+
+    @staticmethod
+    def _walk_font_files(root: str) -> Iterator[Tuple[str, str]]:
+        """Yield (name, path) for .ttf/.ttc files under root, depth-first."""
+        stack = [root]
+        while stack:
+            subdirs: List[str] = []
+            try:
+                entries = os.scandir(stack.pop())
+            except OSError:
+                # Skip unreadable directories, as Path.rglob does, without losing the rest.
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.endswith((".ttf", ".ttc")):
+                        yield entry.name, entry.path
+            stack.extend(reversed(subdirs))
+
     @staticmethod
     def _parse_font_candidate(candidate: str) -> Tuple[str, int]:
         if ";" in candidate:
@@ -305,6 +400,18 @@ def _q(tag: str) -> str:
     return f"{{{SVG_NS}}}{tag}"
 
 
+_SVG_TAG = _q("svg")
+_G_TAG = _q("g")
+_RECT_TAG = _q("rect")
+_TEXT_TAG = _q("text")
+_TSPAN_TAG = _q("tspan")
+_LINE_TAG = _q("line")
+_PATH_TAG = _q("path")
+_DEFS_TAG = _q("defs")
+_MARKER_TAG = _q("marker")
+_STYLE_TAG = _q("style")
+
+
 def diagramagic(
     svgpp_source: str,
     shared_template_sources: Optional[List[str]] = None,
@@ -315,6 +422,27 @@ def diagramagic(
     _max_include_depth: int = 10,
 ) -> str:
     """Convert svg++ markup to plain SVG."""
+    return _pretty_xml(
+        _compile_svg_tree(
+            svgpp_source,
+            shared_template_sources,
+            source_path=source_path,
+            include_stack=_include_stack,
+            include_depth=_include_depth,
+            max_include_depth=_max_include_depth,
+        )
+    )
+
+
+def _compile_svg_tree(
+    svgpp_source: str,
+    shared_template_sources: Optional[List[str]],
+    *,
+    source_path: Optional[Path],
+    include_stack: Optional[List[Path]],
+    include_depth: int,
+    max_include_depth: int,
+) -> ET.Element:
     try:
         root = ET.fromstring(svgpp_source)
     except ET.ParseError as exc:
@@ -350,29 +478,32 @@ def diagramagic(
         diag_ns,
         include_base=include_base,
         shared_template_sources=shared_template_sources,
-        include_stack=_include_stack or [],
-        include_depth=_include_depth,
-        max_include_depth=_max_include_depth,
+        include_stack=include_stack or [],
+        include_depth=include_depth,
+        max_include_depth=max_include_depth,
     )
     if has_includes:
         _ensure_unique_ids(root)
     class_style_rules = _collect_class_style_rules(root)
     _expand_graphs_in_tree(root, diag_ns, class_style_rules)
-    anchor_specs = _collect_anchors(root, diag_ns)
-    arrow_specs = _collect_arrows(root, diag_ns)
+    parent_by_node, arrow_nodes, anchor_nodes = _scan_connector_nodes(root, diag_ns)
+    anchor_specs = _collect_anchors(anchor_nodes)
+    arrow_specs = _collect_arrows(arrow_nodes, parent_by_node)
 
-    svg_root = ET.Element(_q("svg"))
+    svg_root = ET.Element(_SVG_TAG)
     _copy_svg_attributes(root, svg_root, diag_ns)
 
     root_font_family, root_font_path = _font_family_info(root, diag_ns, class_style_rules)
     for child in root:
-        rendered, _, _, bbox = _render_node(
+        # Top-level placement is absolute, so generic nodes need no measuring.
+        rendered, _, _, _ = _render_node(
             child,
             diag_ns,
             wrap_width_hint=None,
             inherited_family=root_font_family,
             inherited_path=root_font_path,
             class_style_rules=class_style_rules,
+            measure=False,
         )
         if rendered is not None:
             svg_root.append(rendered)
@@ -383,7 +514,7 @@ def diagramagic(
     _apply_resvg_bounds(svg_root, original_width, original_height, diag_font_paths, diagram_padding)
     _apply_background_rect(root, svg_root, diag_ns)
 
-    return _pretty_xml(svg_root)
+    return svg_root
 
 
 def _expand_graphs_in_tree(
@@ -434,7 +565,7 @@ def _graph_expansion_state(root: ET.Element, diag_ns: str) -> _GraphExpansionSta
             local = _local_name(node.tag)
             if not (inside_graph and ns == diag_ns and local == "node"):
                 non_graph_ids.add(node_id)
-        for child in list(node):
+        for child in node:
             if child.tag is ET.Comment:
                 continue
             ns = _namespace_of(child.tag)
@@ -498,7 +629,7 @@ def _expand_single_graph(
     node_by_id: Dict[str, _GraphNodeSpec] = {}
     edges: List[_GraphEdgeSpec] = []
 
-    for child in list(graph_node):
+    for child in graph_node:
         if child.tag is ET.Comment:
             continue
         ns = _namespace_of(child.tag)
@@ -597,7 +728,7 @@ def _expand_single_graph(
             # id may already be this graph element's own id from source tree
             pass
         group_attrs["id"] = graph_id
-    rendered_graph = ET.Element(_q("g"), group_attrs)
+    rendered_graph = ET.Element(_G_TAG, group_attrs)
 
     node_bboxes: Dict[str, Tuple[float, float, float, float]] = {}
     for node_spec in nodes:
@@ -618,10 +749,10 @@ def _expand_single_graph(
         default_marker_id = _reserve_unique_id(
             state.taken_ids, f"diag-graph-arrow-default-{graph_index}"
         )
-        defs = ET.SubElement(rendered_graph, _q("defs"))
+        defs = ET.SubElement(rendered_graph, _DEFS_TAG)
         marker = ET.SubElement(
             defs,
-            _q("marker"),
+            _MARKER_TAG,
             {
                 "id": default_marker_id,
                 "viewBox": "0 0 10 10",
@@ -632,7 +763,7 @@ def _expand_single_graph(
                 "orient": "auto",
             },
         )
-        ET.SubElement(marker, _q("path"), {"d": "M 0 0 L 10 5 L 0 10 z", "fill": "#555"})
+        ET.SubElement(marker, _PATH_TAG, {"d": "M 0 0 L 10 5 L 0 10 z", "fill": "#555"})
 
     for idx, edge in enumerate(edges):
         from_bbox = node_bboxes[edge.from_id]
@@ -662,12 +793,12 @@ def _expand_single_graph(
             routing == "auto" and layout == "layered"
         )
         attrs["d"] = _graph_points_to_path_d(edge_points, bezier=use_bezier)
-        rendered_graph.append(ET.Element(_q("path"), attrs))
+        rendered_graph.append(ET.Element(_PATH_TAG, attrs))
 
     for node_spec in nodes:
         nx, ny = layout_positions[node_spec.node_id]
         wrapper = ET.Element(
-            _q("g"),
+            _G_TAG,
             {"id": node_spec.node_id, "transform": f"translate({_fmt(nx)}, {_fmt(ny)})"},
         )
         wrapper.append(node_spec.rendered)
@@ -793,23 +924,23 @@ def _expand_single_include(
             "E_INCLUDE_ROOT", f'included file {resolved_norm} must use <diag:diagram> root'
         )
 
-    compiled_svg = diagramagic(
+    # Stay in tree form; indenting here matches what a serialize/parse round-trip gave.
+    compiled_root = _compile_svg_tree(
         include_text,
-        shared_template_sources=shared_template_sources,
+        shared_template_sources,
         source_path=resolved_norm,
-        _include_stack=include_stack + [resolved_norm],
-        _include_depth=include_depth + 1,
-        _max_include_depth=max_include_depth,
+        include_stack=include_stack + [resolved_norm],
+        include_depth=include_depth + 1,
+        max_include_depth=max_include_depth,
     )
-    compiled_root = ET.fromstring(compiled_svg)
+    _indent_tree(compiled_root)
 
     wrapper_attrs = {"transform": f"translate({_fmt(x)} {_fmt(y)}) scale({_fmt(scale)})"}
     include_id = include_node.get("id")
     if include_id:
         wrapper_attrs["id"] = include_id
-    wrapper = ET.Element(_q("g"), wrapper_attrs)
-    for child in list(compiled_root):
-        wrapper.append(deepcopy(child))
+    wrapper = ET.Element(_G_TAG, wrapper_attrs)
+    wrapper.extend(list(compiled_root))
     return wrapper
 
 
@@ -855,8 +986,7 @@ def _collect_graph_node(
     if bg_style:
         flex_node.set("background-style", bg_style)
 
-    for child in list(node):
-        flex_node.append(deepcopy(child))
+    flex_node.extend(_clone_element(child) for child in node)
 
     rendered, measured_width, measured_height, _ = _render_flex(
         flex_node,
@@ -890,7 +1020,7 @@ def _collect_graph_node(
         rendered.set(key, value)
 
     if not math.isclose(final_width, measured_width, abs_tol=1e-9):
-        for child in list(rendered):
+        for child in rendered:
             if _local_name(child.tag) != "rect":
                 continue
             if child.get("class") == bg_class or (bg_class is None and bg_style and child.get("style") == bg_style):
@@ -1120,7 +1250,7 @@ def _emit_graph_edge_label(
         "dominant-baseline": "alphabetic",
     }
     _apply_label_rotation(attrs, edge.label_rotate, dx=dx, dy=dy, x=lx, y=ly)
-    label = ET.Element(_q("text"), attrs)
+    label = ET.Element(_TEXT_TAG, attrs)
     label.text = edge.label
     graph_group.append(label)
 
@@ -1142,7 +1272,7 @@ def _emit_graph_edge_label_at(
     # parser path; for follow mode here we keep horizontal fallback until tangent
     # data is threaded through.
     _apply_label_rotation(attrs, edge.label_rotate, dx=0.0, dy=0.0, x=point[0], y=point[1])
-    label = ET.Element(_q("text"), attrs)
+    label = ET.Element(_TEXT_TAG, attrs)
     label.text = edge.label
     graph_group.append(label)
 
@@ -1184,10 +1314,12 @@ def _clip_graph_edge_points_to_nodes(
     adjusted = [*points]
     start_target = adjusted[1]
     end_source = adjusted[-2]
-    start_center = _bbox_center(from_bbox)
-    end_center = _bbox_center(to_bbox)
-    start_clip = _ray_rect_intersection(start_center, start_target, from_bbox)
-    end_clip = _ray_rect_intersection(end_center, end_source, to_bbox)
+    start_cx, start_cy = _bbox_center(from_bbox)
+    end_cx, end_cy = _bbox_center(to_bbox)
+    start_clip = _ray_rect_intersection(
+        start_cx, start_cy, start_target[0], start_target[1], from_bbox
+    )
+    end_clip = _ray_rect_intersection(end_cx, end_cy, end_source[0], end_source[1], to_bbox)
     if start_clip is not None:
         adjusted[0] = start_clip
     if end_clip is not None:
@@ -1562,26 +1694,11 @@ def render_png(
 
 def _apply_focus_crop(svg_text: str, focus_id: str, padding: float) -> str:
     root = ET.fromstring(svg_text)
-    measurement = _measure_svg(svg_text, [])
-    nodes = measurement.get("nodes") or []
-
-    matched_bbox: Optional[Tuple[float, float, float, float]] = None
-    element_exists = False
-    for node in root.iter():
-        if node.get("id") == focus_id:
-            element_exists = True
-            break
-
-    for node in nodes:
-        if node.get("id") == focus_id:
-            bbox = node.get("bbox")
-            if bbox and len(bbox) == 4:
-                matched_bbox = (bbox[0], bbox[1], bbox[2], bbox[3])
-                break
-
-    if not element_exists:
+    if not any(node.get("id") == focus_id for node in root.iter()):
         raise FocusNotFoundError(f'focus id "{focus_id}" not found')
 
+    measurement = _measure_svg(svg_text, [])
+    matched_bbox = _focus_bbox(measurement, focus_id)
     if matched_bbox is None:
         # Exists but has no measurable bbox (e.g. display:none). Rendering still succeeds.
         return svg_text
@@ -1599,6 +1716,17 @@ def _apply_focus_crop(svg_text: str, focus_id: str, padding: float) -> str:
     return ET.tostring(root, encoding="unicode")
 
 
+def _focus_bbox(
+    measurement: dict, focus_id: str
+) -> Optional[Tuple[float, float, float, float]]:
+    for node in measurement.get("nodes") or []:
+        if node.get("id") == focus_id:
+            bbox = node.get("bbox")
+            if bbox and len(bbox) == 4:
+                return (bbox[0], bbox[1], bbox[2], bbox[3])
+    return None
+
+
 def _render_node(
     node: ET.Element,
     diag_ns: str,
@@ -1606,6 +1734,7 @@ def _render_node(
     inherited_family: Optional[str],
     inherited_path: Optional[str],
     class_style_rules: List[_ClassStyleRule],
+    measure: bool = True,
 ) -> Tuple[
     Optional[ET.Element],
     float,
@@ -1648,6 +1777,8 @@ def _render_node(
         inherited_path,
         class_style_rules,
     )
+    if not measure:
+        return rendered, 0.0, 0.0, None
     width, height, bbox = _measure_rendered_node(rendered)
     return rendered, width, height, bbox
 
@@ -1678,7 +1809,7 @@ def _render_flex(
     child_wrap_hint = None
     if target_total_width is not None:
         child_wrap_hint = max(target_total_width - 2 * padding, 0.0)
-    for child in list(node):
+    for child in node:
         rendered, w, h, _ = _render_node(
             child,
             diag_ns,
@@ -1691,15 +1822,15 @@ def _render_flex(
             child_entries.append((rendered, w, h))
 
     g_attrs = {"transform": f"translate({_fmt(x)}, {_fmt(y)})"}
-    consumed = {"x", "y", "width", "direction", "gap", "padding", "background-class", "background-style"}
+    diag_prefix = _qual(diag_ns, "")
     for key, value in node.attrib.items():
-        if _namespace_of(key) == diag_ns:
+        if key.startswith(diag_prefix):
             continue
-        local_key = _local_name(key)
-        if local_key in consumed:
+        local_key = _local_name(key) if key.startswith("{") else key
+        if local_key in _FLEX_CONSUMED_ATTRS:
             continue
         g_attrs[local_key] = value
-    g = ET.Element(_q("g"), g_attrs)
+    g = ET.Element(_G_TAG, g_attrs)
 
     if direction == "row":
         width, height = _layout_row(
@@ -1721,7 +1852,7 @@ def _render_flex(
             rect_attrs["class"] = bg_class
         if bg_style:
             rect_attrs["style"] = bg_style
-        g.insert(0, ET.Element(_q("rect"), rect_attrs))
+        g.insert(0, ET.Element(_RECT_TAG, rect_attrs))
 
     bbox = (x, y, x + width, y + height)
     return g, width, height, bbox
@@ -1746,13 +1877,13 @@ def _layout_column(
         interior_width = interior_target
     else:
         interior_width = max_child_width
+    x_text = _fmt(padding)
     y_cursor = padding
     for child, child_width, child_height in children:
-        wrapper = ET.Element(
-            _q("g"), {"transform": f"translate({_fmt(padding)}, {_fmt(y_cursor)})"}
+        wrapper = ET.SubElement(
+            container, _G_TAG, {"transform": f"translate({x_text}, {_fmt(y_cursor)})"}
         )
         wrapper.append(child)
-        container.append(wrapper)
         y_cursor += child_height + gap
     if children:
         y_cursor -= gap
@@ -1784,13 +1915,13 @@ def _layout_row(
     else:
         interior_width = natural_width
     max_height = max((h for _, _, h in children), default=0.0)
+    y_text = _fmt(padding)
     x_cursor = padding
     for child, child_width, child_height in children:
-        wrapper = ET.Element(
-            _q("g"), {"transform": f"translate({_fmt(x_cursor)}, {_fmt(padding)})"}
+        wrapper = ET.SubElement(
+            container, _G_TAG, {"transform": f"translate({_fmt(x_cursor)}, {y_text})"}
         )
         wrapper.append(child)
-        container.append(wrapper)
         x_cursor += child_width + gap
     total_width = interior_width + 2 * padding
     total_height = max_height + 2 * padding
@@ -1838,18 +1969,16 @@ def _render_text(
         new_text.text = None
         base_x = node.get("x", "0")
         first_tspan = True
-        max_line_width = 0.0
         for line in lines:
-            line_width = _estimate_text_width(line, font_size, font_family, font_path)
-            max_line_width = max(max_line_width, line_width)
             attrs = {"x": base_x}
             attrs["dy"] = "0" if first_tspan else "1.2em"
-            tspan = ET.SubElement(new_text, _q("tspan"), attrs)
+            tspan = ET.SubElement(new_text, _TSPAN_TAG, attrs)
             tspan.text = line
             first_tspan = False
         line_count = max(len(lines), 1)
         height = ascent + descent + (line_count - 1) * line_height
-        width = wrap_width_hint if wrap_width_hint is not None else max_line_width
+        # Wrapped text always occupies the full wrap width.
+        width = wrap_width_hint
         bbox = _text_bbox(node, width, height, ascent)
         return new_text, width, height, bbox
 
@@ -1871,22 +2000,47 @@ def _wrap_lines(
     font_family: Optional[str],
     font_path: Optional[str],
 ) -> List[str]:
-    words = re.split(r"(\s+)", text.strip())
+    stripped = text.strip()
+    # Text that fits as a whole is a single line; one measurement settles it.
+    # The loop below sums token widths, which matches this exactly for the
+    # heuristic measurer but only approximately with Pillow fonts (kerning
+    # across a space is dropped), so the two can disagree right at the limit.
+    if _estimate_text_width(stripped, font_size, font_family, font_path) <= width_limit:
+        return [stripped]
+    words = _WHITESPACE_SPLIT_RE.split(stripped)
     lines: List[str] = []
     current = ""
-    for chunk in words:
+    # Widths of the stripped line and of the whitespace trailing it; each
+    # chunk is measured once and the candidate width is accumulated.
+    current_width = 0.0
+    trailing_width = 0.0
+    has_word = False
+    for index, chunk in enumerate(words):
         if not chunk:
             continue
-        candidate = (current + chunk) if current else chunk
-        if (
-            _estimate_text_width(candidate.strip(), font_size, font_family, font_path)
-            <= width_limit
-        ):
-            current = candidate
+        is_space = index % 2 == 1
+        chunk_width = _estimate_text_width(chunk, font_size, font_family, font_path)
+        if is_space:
+            candidate_width = current_width if has_word else 0.0
+        elif has_word:
+            candidate_width = current_width + trailing_width + chunk_width
+        else:
+            candidate_width = chunk_width
+        if candidate_width <= width_limit:
+            current += chunk
+            if not is_space:
+                current_width = candidate_width
+                trailing_width = 0.0
+                has_word = True
+            elif has_word:
+                trailing_width += chunk_width
             continue
         if current:
             lines.append(current.strip())
         current = chunk.strip()
+        has_word = not is_space
+        current_width = 0.0 if is_space else chunk_width
+        trailing_width = 0.0
     if current:
         lines.append(current.strip())
     return lines or [""]
@@ -1906,9 +2060,11 @@ def _text_bbox(
 def _measure_rendered_node(
     rendered: ET.Element,
 ) -> Tuple[float, float, Optional[Tuple[float, float, float, float]]]:
-    scratch_svg = ET.Element(_q("svg"))
-    scratch_svg.append(deepcopy(rendered))
-    measurement = _measure_svg(ET.tostring(scratch_svg, encoding="unicode"), [])
+    # ElementTree children carry no parent pointer and the scratch root is
+    # discarded, so the rendered node can be attached without copying.
+    scratch_svg = ET.Element(_SVG_TAG)
+    scratch_svg.append(rendered)
+    measurement = _measure_svg(ET.tostring(scratch_svg, encoding="utf-8"), [])
     overall = measurement.get("overall")
     if not overall:
         return 0.0, 0.0, None
@@ -1918,32 +2074,67 @@ def _measure_rendered_node(
 
 def _collect_templates_from_sources(
     template_sources: List[str], diag_ns: str
-) -> Dict[str, List[ET.Element]]:
-    templates: Dict[str, List[ET.Element]] = {}
+) -> Dict[str, Sequence[ET.Element]]:
+    templates: Dict[str, Sequence[ET.Element]] = {}
     for source in template_sources:
-        parsed = ET.fromstring(source)
-        if _namespace_of(parsed.tag) != diag_ns or _local_name(parsed.tag) != "diagram":
-            raise ValueError("Template source must use the same diag namespace and <diag:diagram> root")
-        templates.update(_collect_templates(parsed, diag_ns))
+        templates.update(_templates_from_source(source, diag_ns))
     return templates
 
 
-def _collect_arrows(root: ET.Element, diag_ns: str) -> List[_ArrowSpec]:
-    arrows: List[_ArrowSpec] = []
-    parent_by_node: Dict[ET.Element, ET.Element] = {}
-    for parent in root.iter():
-        for child in list(parent):
-            parent_by_node[child] = parent
+@lru_cache(maxsize=16)
+def _templates_from_source(
+    source: str, diag_ns: str
+) -> Tuple[Tuple[str, Tuple[ET.Element, ...]], ...]:
+    """Parse one shared template source into (name, blueprint) pairs.
+
+    Shared sources are re-read for every include and every compile, so the
+    result is cached and handed to every caller. The containers are tuples so
+    they cannot be changed in place; the blueprint elements themselves are
+    shared and must only be used through `_instantiate_template`, which clones
+    them before applying overrides.
+    """
+    parsed = ET.fromstring(source)
+    if _namespace_of(parsed.tag) != diag_ns or _local_name(parsed.tag) != "diagram":
+        raise ValueError("Template source must use the same diag namespace and <diag:diagram> root")
+    return tuple(
+        (name, tuple(blueprint)) for name, blueprint in _collect_templates(parsed, diag_ns).items()
+    )
 
-    arrow_nodes = [
-        node
-        for node in root.iter()
-        if _namespace_of(node.tag) == diag_ns and _local_name(node.tag) == "arrow"
-    ]
-    for index, node in enumerate(arrow_nodes):
-        if _namespace_of(node.tag) != diag_ns or _local_name(node.tag) != "arrow":
-            continue
 
+def _scan_connector_nodes(
+    root: ET.Element, diag_ns: str
+) -> Tuple[
+    Dict[ET.Element, ET.Element], List[Tuple[ET.Element, int]], List[ET.Element]
+]:
+    """Map each node to its parent and collect diag:arrow/diag:anchor nodes in one walk.
+
+    Arrows are returned with their position among their parent's children so
+    they can be swapped for slot groups without searching the sibling list.
+    """
+    arrow_tag = _qual(diag_ns, "arrow")
+    anchor_tag = _qual(diag_ns, "anchor")
+    parent_by_node: Dict[ET.Element, ET.Element] = {}
+    index_by_arrow: Dict[ET.Element, int] = {}
+    arrow_nodes: List[Tuple[ET.Element, int]] = []
+    anchor_nodes: List[ET.Element] = []
+    for node in root.iter():
+        for position, child in enumerate(node):
+            parent_by_node[child] = node
+            if child.tag == arrow_tag:
+                index_by_arrow[child] = position
+        if node.tag == arrow_tag:
+            arrow_nodes.append((node, index_by_arrow.get(node, -1)))
+        elif node.tag == anchor_tag:
+            anchor_nodes.append(node)
+    return parent_by_node, arrow_nodes, anchor_nodes
+
+
+def _collect_arrows(
+    arrow_nodes: List[Tuple[ET.Element, int]],
+    parent_by_node: Dict[ET.Element, ET.Element],
+) -> List[_ArrowSpec]:
+    arrows: List[_ArrowSpec] = []
+    for index, (node, position) in enumerate(arrow_nodes):
         from_id = (node.get("from") or "").strip()
         to_id = (node.get("to") or "").strip()
         if not from_id:
@@ -1995,23 +2186,17 @@ def _collect_arrows(root: ET.Element, diag_ns: str) -> List[_ArrowSpec]:
         )
         parent = parent_by_node.get(node)
         if parent is not None:
-            replacement = ET.Element(_q("g"), {"data-diag-arrow-slot": slot_id})
-            children = list(parent)
-            insert_at = children.index(node)
-            parent.remove(node)
-            parent.insert(insert_at, replacement)
-        elif node is root:
+            replacement = ET.Element(_G_TAG, {"data-diag-arrow-slot": slot_id})
+            parent[position] = replacement
+        else:
             raise ValueError("diag:arrow cannot be the document root element")
 
     return arrows
 
 
-def _collect_anchors(root: ET.Element, diag_ns: str) -> List[_AnchorSpec]:
+def _collect_anchors(anchor_nodes: List[ET.Element]) -> List[_AnchorSpec]:
     anchors: List[_AnchorSpec] = []
-    for node in root.iter():
-        if _namespace_of(node.tag) != diag_ns or _local_name(node.tag) != "anchor":
-            continue
-
+    for node in anchor_nodes:
         anchor_id = (node.get("id") or "").strip()
         if not anchor_id:
             raise ValueError("diag:anchor requires non-empty 'id' attribute")
@@ -2058,44 +2243,59 @@ def _collect_anchors(root: ET.Element, diag_ns: str) -> List[_AnchorSpec]:
 
 
 def _emit_arrows(svg_root: ET.Element, arrows: List[_ArrowSpec], anchors: List[_AnchorSpec]) -> None:
-    svg_text = ET.tostring(svg_root, encoding="unicode")
-    measurement = _measure_svg(svg_text, [])
-    nodes = measurement.get("nodes") or []
     bbox_by_id: Dict[str, Tuple[float, float, float, float]] = {}
+    # Absolute anchors alone resolve without element bboxes.
+    measured = bool(arrows) or any(anchor.relative_to for anchor in anchors)
+    if measured:
+        measurement = _measure_svg(ET.tostring(svg_root, encoding="utf-8"), [])
+        for node in measurement.get("nodes") or []:
+            node_id = node.get("id")
+            bbox = node.get("bbox")
+            if not node_id or not bbox:
+                continue
+            if node_id in bbox_by_id:
+                raise ValueError(
+                    f'duplicate id "{node_id}" found while resolving diag:arrow endpoints'
+                )
+            bbox_by_id[node_id] = (bbox[0], bbox[1], bbox[2], bbox[3])
 
-    for node in nodes:
-        node_id = node.get("id")
-        bbox = node.get("bbox")
-        if not node_id or not bbox:
-            continue
-        if node_id in bbox_by_id:
-            raise ValueError(f'duplicate id "{node_id}" found while resolving diag:arrow endpoints')
-        bbox_by_id[node_id] = (bbox[0], bbox[1], bbox[2], bbox[3])
-
-    seen_ids: Dict[str, int] = {}
+    seen_ids: Counter[str] = Counter()
+    parent_by_node: Dict[ET.Element, ET.Element] = {}
+    slot_nodes: Dict[str, ET.Element] = {}
     for node in svg_root.iter():
+        for child in node:
+            parent_by_node[child] = node
         node_id = node.get("id")
-        if not node_id:
-            continue
-        seen_ids[node_id] = seen_ids.get(node_id, 0) + 1
+        if node_id:
+            seen_ids[node_id] += 1
+        slot_id = node.get("data-diag-arrow-slot")
+        if slot_id:
+            slot_nodes[slot_id] = node
 
-    anchor_counts: Dict[str, int] = {}
-    for anchor in anchors:
-        anchor_counts[anchor.anchor_id] = anchor_counts.get(anchor.anchor_id, 0) + 1
+    if not measured:
+        # Measurement rejects duplicate ids; keep that check when it was skipped.
+        for node_id, count in seen_ids.items():
+            if count > 1:
+                raise ValueError(
+                    f'duplicate id "{node_id}" found while resolving diag:arrow endpoints'
+                )
+
+    anchor_counts = Counter(anchor.anchor_id for anchor in anchors)
     for anchor_id, count in anchor_counts.items():
         if count > 1:
             raise ValueError(f'diag:anchor id="{anchor_id}" is duplicated')
-        if seen_ids.get(anchor_id, 0) > 0:
+        if seen_ids[anchor_id] > 0:
             raise ValueError(f'diag:anchor id="{anchor_id}" collides with an existing element id')
 
     anchor_points: Dict[str, Tuple[float, float]] = {}
     for anchor in anchors:
         if anchor.relative_to:
-            if seen_ids.get(anchor.relative_to, 0) == 0:
+            relative_count = seen_ids[anchor.relative_to]
+            if relative_count == 0:
                 raise ValueError(
                     f'diag:anchor id="{anchor.anchor_id}" relative-to="{anchor.relative_to}" id not found'
                 )
-            if seen_ids.get(anchor.relative_to, 0) > 1:
+            if relative_count > 1:
                 raise ValueError(
                     f'diag:anchor id="{anchor.anchor_id}" relative-to="{anchor.relative_to}" is duplicated'
                 )
@@ -2111,15 +2311,13 @@ def _emit_arrows(svg_root: ET.Element, arrows: List[_ArrowSpec], anchors: List[_
         anchor_points[anchor.anchor_id] = (px + anchor.offset_x, py + anchor.offset_y)
 
     default_marker_id: Optional[str] = None
-    parent_by_node: Dict[ET.Element, ET.Element] = {}
-    slot_nodes: Dict[str, ET.Element] = {}
-    for parent in svg_root.iter():
-        for child in list(parent):
-            parent_by_node[child] = parent
-        slot_id = parent.get("data-diag-arrow-slot")
-        if slot_id:
-            slot_nodes[slot_id] = parent
-
+    # Arrows only append to their containers, so each container's transform
+    # chain is fixed for the whole pass.
+    inverse_ctm_by_container: Dict[
+        ET.Element, Optional[Tuple[float, float, float, float, float, float]]
+    ] = {}
+    # Ids added by emitted lines, which seen_ids (taken before emission) lacks.
+    emitted_ids: Set[str] = set()
     for arrow in arrows:
         from_anchor = anchor_points.get(arrow.from_id)
         to_anchor = anchor_points.get(arrow.to_id)
@@ -2127,18 +2325,20 @@ def _emit_arrows(svg_root: ET.Element, arrows: List[_ArrowSpec], anchors: List[_
         from_bbox: Optional[Tuple[float, float, float, float]] = None
         to_bbox: Optional[Tuple[float, float, float, float]] = None
         if from_anchor is None:
-            if seen_ids.get(arrow.from_id, 0) == 0:
+            from_count = seen_ids[arrow.from_id]
+            if from_count == 0:
                 raise ValueError(f'diag:arrow from="{arrow.from_id}" id not found')
-            if seen_ids.get(arrow.from_id, 0) > 1:
+            if from_count > 1:
                 raise ValueError(f'diag:arrow from="{arrow.from_id}" is duplicated')
             from_bbox = bbox_by_id.get(arrow.from_id)
             if from_bbox is None:
                 raise ValueError(f'diag:arrow from="{arrow.from_id}" has no measurable bbox')
 
         if to_anchor is None:
-            if seen_ids.get(arrow.to_id, 0) == 0:
+            to_count = seen_ids[arrow.to_id]
+            if to_count == 0:
                 raise ValueError(f'diag:arrow to="{arrow.to_id}" id not found')
-            if seen_ids.get(arrow.to_id, 0) > 1:
+            if to_count > 1:
                 raise ValueError(f'diag:arrow to="{arrow.to_id}" is duplicated')
             to_bbox = bbox_by_id.get(arrow.to_id)
             if to_bbox is None:
@@ -2159,8 +2359,11 @@ def _emit_arrows(svg_root: ET.Element, arrows: List[_ArrowSpec], anchors: List[_
         target_container = slot_nodes.get(arrow.slot_id, svg_root)
         local_from, local_to = p_from, p_to
         if target_container is not svg_root:
-            ctm = _container_ctm(target_container, parent_by_node)
-            inv = _invert_affine(ctm)
+            if target_container in inverse_ctm_by_container:
+                inv = inverse_ctm_by_container[target_container]
+            else:
+                inv = _invert_affine(_container_ctm(target_container, parent_by_node))
+                inverse_ctm_by_container[target_container] = inv
             if inv is not None:
                 local_from = _apply_affine(inv, p_from)
                 local_to = _apply_affine(inv, p_to)
@@ -2179,11 +2382,15 @@ def _emit_arrows(svg_root: ET.Element, arrows: List[_ArrowSpec], anchors: List[_
 
         if "marker-end" not in line_attrs and "marker-start" not in line_attrs:
             if default_marker_id is None:
-                default_marker_id = _ensure_default_arrow_marker(svg_root)
+                default_marker_id = _ensure_default_arrow_marker(
+                    svg_root, existing_ids=set(seen_ids) | emitted_ids
+                )
             line_attrs["marker-end"] = f"url(#{default_marker_id})"
 
-        line = ET.Element(_q("line"), line_attrs)
+        line = ET.Element(_LINE_TAG, line_attrs)
         target_container.append(line)
+        if "id" in line_attrs:
+            emitted_ids.add(line_attrs["id"])
 
         if arrow.label:
             _emit_arrow_label(target_container, arrow, local_from, local_to)
@@ -2193,8 +2400,11 @@ def _emit_arrows(svg_root: ET.Element, arrows: List[_ArrowSpec], anchors: List[_
             del node.attrib["data-diag-arrow-slot"]
 
 
-def _ensure_default_arrow_marker(svg_root: ET.Element) -> str:
-    existing_ids = {node.get("id") for node in svg_root.iter() if node.get("id")}
+def _ensure_default_arrow_marker(
+    svg_root: ET.Element, existing_ids: Optional[Set[str]] = None
+) -> str:
+    if existing_ids is None:
+        existing_ids = {node.get("id") for node in svg_root.iter() if node.get("id")}
     marker_id = "diag-arrow-default"
     if marker_id in existing_ids:
         marker_id = "diag-arrow-default-1"
@@ -2203,13 +2413,13 @@ def _ensure_default_arrow_marker(svg_root: ET.Element) -> str:
             idx += 1
             marker_id = f"diag-arrow-default-{idx}"
 
-    defs = svg_root.find(_q("defs"))
+    defs = svg_root.find(_DEFS_TAG)
     if defs is None:
-        defs = ET.Element(_q("defs"))
+        defs = ET.Element(_DEFS_TAG)
         svg_root.insert(0, defs)
 
     marker = ET.Element(
-        _q("marker"),
+        _MARKER_TAG,
         {
             "id": marker_id,
             "viewBox": "0 0 10 10",
@@ -2220,11 +2430,14 @@ def _ensure_default_arrow_marker(svg_root: ET.Element) -> str:
             "orient": "auto",
         },
     )
-    ET.SubElement(marker, _q("path"), {"d": "M 0 0 L 10 5 L 0 10 z", "fill": "#555"})
+    ET.SubElement(marker, _PATH_TAG, {"d": "M 0 0 L 10 5 L 0 10 z", "fill": "#555"})
     defs.append(marker)
     return marker_id
 
 
+_ARROW_EDGE_CANDIDATES = ("right", "left", "bottom", "top", "center")
+
+
 def _resolve_arrow_points(
     from_bbox: Tuple[float, float, float, float],
     to_bbox: Tuple[float, float, float, float],
@@ -2233,21 +2446,26 @@ def _resolve_arrow_points(
     if centerline is not None:
         return centerline
 
-    candidates = ["right", "left", "bottom", "top", "center"]
-    from_edges = candidates
-    to_edges = candidates
-
+    from_center = _bbox_center(from_bbox)
+    to_center = _bbox_center(to_bbox)
+    from_segments = _bbox_edge_segments(from_bbox)
+    to_segments = _bbox_edge_segments(to_bbox)
     best: Optional[Tuple[float, int, Tuple[float, float], Tuple[float, float]]] = None
-    tie_break_order = {name: idx for idx, name in enumerate(candidates)}
-    for fe in from_edges:
-        for te in to_edges:
-            p1, p2 = _arrow_points_for_edges(from_bbox, to_bbox, fe, te)
+    # Pairs are visited in ascending tie-break order, so once the best distance
+    # is within tolerance of zero no later pair can displace it.
+    for from_index, fe in enumerate(_ARROW_EDGE_CANDIDATES):
+        for to_index, te in enumerate(_ARROW_EDGE_CANDIDATES):
+            p1, p2 = _arrow_points_for_edges(
+                from_center, from_segments, to_center, to_segments, fe, te
+            )
             dist = math.hypot(p2[0] - p1[0], p2[1] - p1[1])
-            tie = tie_break_order[fe] * 10 + tie_break_order[te]
+            tie = from_index * 10 + to_index
             if best is None or dist < best[0] - 1e-9 or (
                 math.isclose(dist, best[0], abs_tol=1e-9) and tie < best[1]
             ):
                 best = (dist, tie, p1, p2)
+                if dist <= 1e-9:
+                    return p1, p2
 
     assert best is not None
     return best[2], best[3]
@@ -2257,78 +2475,78 @@ def _resolve_arrow_points_centerline(
     from_bbox: Tuple[float, float, float, float],
     to_bbox: Tuple[float, float, float, float],
 ) -> Optional[Tuple[Tuple[float, float], Tuple[float, float]]]:
-    c1 = _bbox_center(from_bbox)
-    c2 = _bbox_center(to_bbox)
-    if math.isclose(c1[0], c2[0], abs_tol=1e-9) and math.isclose(c1[1], c2[1], abs_tol=1e-9):
+    from_left, from_top, from_right, from_bottom = from_bbox
+    to_left, to_top, to_right, to_bottom = to_bbox
+    c1x = (from_left + from_right) / 2.0
+    c1y = (from_top + from_bottom) / 2.0
+    c2x = (to_left + to_right) / 2.0
+    c2y = (to_top + to_bottom) / 2.0
+    if math.isclose(c1x, c2x, abs_tol=1e-9) and math.isclose(c1y, c2y, abs_tol=1e-9):
         return None
-    p1 = _ray_rect_intersection(c1, c2, from_bbox)
-    p2 = _ray_rect_intersection(c2, c1, to_bbox)
+    p1 = _ray_rect_intersection(c1x, c1y, c2x, c2y, from_bbox)
+    p2 = _ray_rect_intersection(c2x, c2y, c1x, c1y, to_bbox)
     if p1 is None or p2 is None:
         return None
     return p1, p2
 
 
 def _ray_rect_intersection(
-    origin: Tuple[float, float],
-    toward: Tuple[float, float],
+    ox: float,
+    oy: float,
+    tx: float,
+    ty: float,
     bbox: Tuple[float, float, float, float],
 ) -> Optional[Tuple[float, float]]:
-    ox, oy = origin
-    tx, ty = toward
     dx = tx - ox
     dy = ty - oy
     if abs(dx) < 1e-12 and abs(dy) < 1e-12:
         return None
 
     left, top, right, bottom = bbox
-    candidates: List[Tuple[float, float, float]] = []
+    best: Optional[Tuple[float, float]] = None
+    best_t = math.inf
 
     if abs(dx) > 1e-12:
         for x in (left, right):
             t = (x - ox) / dx
-            if t <= 1e-12:
+            if t <= 1e-12 or t >= best_t:
                 continue
             y = oy + t * dy
             if top - 1e-9 <= y <= bottom + 1e-9:
-                candidates.append((t, x, y))
+                best_t = t
+                best = (x, y)
 
     if abs(dy) > 1e-12:
         for y in (top, bottom):
             t = (y - oy) / dy
-            if t <= 1e-12:
+            if t <= 1e-12 or t >= best_t:
                 continue
             x = ox + t * dx
             if left - 1e-9 <= x <= right + 1e-9:
-                candidates.append((t, x, y))
-
-    if not candidates:
-        return None
+                best_t = t
+                best = (x, y)
 
-    t, x, y = min(candidates, key=lambda item: item[0])
-    del t
-    return (x, y)
+    return best
 
 
 def _arrow_points_for_edges(
-    from_bbox: Tuple[float, float, float, float],
-    to_bbox: Tuple[float, float, float, float],
+    from_center: Tuple[float, float],
+    from_segments: Dict[str, Tuple[Tuple[float, float], Tuple[float, float]]],
+    to_center: Tuple[float, float],
+    to_segments: Dict[str, Tuple[Tuple[float, float], Tuple[float, float]]],
     from_edge: str,
     to_edge: str,
 ) -> Tuple[Tuple[float, float], Tuple[float, float]]:
     if from_edge == "center" and to_edge == "center":
-        return _bbox_center(from_bbox), _bbox_center(to_bbox)
+        return from_center, to_center
     if from_edge == "center":
-        p1 = _bbox_center(from_bbox)
-        p2 = _nearest_point_on_edge(to_bbox, to_edge, p1)
-        return p1, p2
+        p2 = _nearest_point_on_segment(to_segments[to_edge], from_center)
+        return from_center, p2
     if to_edge == "center":
-        p2 = _bbox_center(to_bbox)
-        p1 = _nearest_point_on_edge(from_bbox, from_edge, p2)
-        return p1, p2
+        p1 = _nearest_point_on_segment(from_segments[from_edge], to_center)
+        return p1, to_center
 
-    seg1 = _edge_segment(from_bbox, from_edge)
-    seg2 = _edge_segment(to_bbox, to_edge)
-    return _closest_points_on_segments(seg1[0], seg1[1], seg2[0], seg2[1])
+    return _closest_points_on_segments(from_segments[from_edge], to_segments[to_edge])
 
 
 def _emit_arrow_label(
@@ -2362,7 +2580,7 @@ def _emit_arrow_label(
         "dominant-baseline": "alphabetic",
     }
     _apply_label_rotation(attrs, arrow.label_rotate, dx=dx, dy=dy, x=lx, y=ly)
-    text = ET.Element(_q("text"), attrs)
+    text = ET.Element(_TEXT_TAG, attrs)
     text.text = arrow.label
     svg_root.append(text)
 
@@ -2443,32 +2661,33 @@ def _anchor_point_from_bbox(
 def _point_on_bbox_toward(
     bbox: Tuple[float, float, float, float], toward: Tuple[float, float]
 ) -> Tuple[float, float]:
-    center = _bbox_center(bbox)
-    point = _ray_rect_intersection(center, toward, bbox)
+    cx, cy = _bbox_center(bbox)
+    point = _ray_rect_intersection(cx, cy, toward[0], toward[1], bbox)
     if point is not None:
         return point
-    return center
+    return cx, cy
 
 
-def _edge_segment(
-    bbox: Tuple[float, float, float, float], edge: str
-) -> Tuple[Tuple[float, float], Tuple[float, float]]:
+def _bbox_edge_segments(
+    bbox: Tuple[float, float, float, float]
+) -> Dict[str, Tuple[Tuple[float, float], Tuple[float, float]]]:
     left, top, right, bottom = bbox
-    if edge == "left":
-        return (left, top), (left, bottom)
-    if edge == "right":
-        return (right, top), (right, bottom)
-    if edge == "top":
-        return (left, top), (right, top)
-    if edge == "bottom":
-        return (left, bottom), (right, bottom)
-    raise ValueError(f"invalid edge for segment resolution: {edge}")
-
-
-def _nearest_point_on_edge(
-    bbox: Tuple[float, float, float, float], edge: str, point: Tuple[float, float]
+    top_left = (left, top)
+    top_right = (right, top)
+    bottom_left = (left, bottom)
+    bottom_right = (right, bottom)
+    return {
+        "right": (top_right, bottom_right),
+        "left": (top_left, bottom_left),
+        "bottom": (bottom_left, bottom_right),
+        "top": (top_left, top_right),
+    }
+
+
+def _nearest_point_on_segment(
+    segment: Tuple[Tuple[float, float], Tuple[float, float]], point: Tuple[float, float]
 ) -> Tuple[float, float]:
-    (x1, y1), (x2, y2) = _edge_segment(bbox, edge)
+    (x1, y1), (x2, y2) = segment
     px, py = point
     vx = x2 - x1
     vy = y2 - y1
@@ -2481,16 +2700,12 @@ def _nearest_point_on_edge(
 
 
 def _closest_points_on_segments(
-    p1: Tuple[float, float],
-    q1: Tuple[float, float],
-    p2: Tuple[float, float],
-    q2: Tuple[float, float],
+    seg1: Tuple[Tuple[float, float], Tuple[float, float]],
+    seg2: Tuple[Tuple[float, float], Tuple[float, float]],
 ) -> Tuple[Tuple[float, float], Tuple[float, float]]:
     # Standard closest-points algorithm for two 2D segments.
-    x1, y1 = p1
-    x2, y2 = q1
-    x3, y3 = p2
-    x4, y4 = q2
+    (x1, y1), (x2, y2) = seg1
+    (x3, y3), (x4, y4) = seg2
 
     ux, uy = x2 - x1, y2 - y1
     vx, vy = x4 - x3, y4 - y3
@@ -2569,8 +2784,11 @@ def _container_ctm(
     return m
 
 
+_IDENTITY_AFFINE = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+
 def _identity_affine() -> Tuple[float, float, float, float, float, float]:
-    return (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+    return _IDENTITY_AFFINE
 
 
 def _mul_affine(
@@ -2578,6 +2796,10 @@ def _mul_affine(
     m2: Tuple[float, float, float, float, float, float],
 ) -> Tuple[float, float, float, float, float, float]:
     # Composition m = m1 ∘ m2
+    if m1 == _IDENTITY_AFFINE:
+        return m2
+    if m2 == _IDENTITY_AFFINE:
+        return m1
     a1, b1, c1, d1, e1, f1 = m1
     a2, b2, c2, d2, e2, f2 = m2
     return (
@@ -2593,6 +2815,8 @@ def _mul_affine(
 def _apply_affine(
     m: Tuple[float, float, float, float, float, float], p: Tuple[float, float]
 ) -> Tuple[float, float]:
+    if m == _IDENTITY_AFFINE:
+        return p
     a, b, c, d, e, f = m
     x, y = p
     return (a * x + c * y + e, b * x + d * y + f)
@@ -2601,6 +2825,8 @@ def _apply_affine(
 def _invert_affine(
     m: Tuple[float, float, float, float, float, float]
 ) -> Optional[Tuple[float, float, float, float, float, float]]:
+    if m == _IDENTITY_AFFINE:
+        return m
     a, b, c, d, e, f = m
     det = a * d - b * c
     if abs(det) < 1e-12:
@@ -2615,14 +2841,17 @@ def _invert_affine(
     return (ai, bi, ci, di, ei, fi)
 
 
+# Flex wrappers repeat the same translate() strings, so parsed affines are
+# cached; the result is an immutable tuple.
+@lru_cache(maxsize=1024)
 def _parse_transform_affine(
     transform: str,
 ) -> Tuple[float, float, float, float, float, float]:
     m = _identity_affine()
-    for fn, arg_text in re.findall(r"([a-zA-Z]+)\s*\(([^)]*)\)", transform):
+    for fn, arg_text in _TRANSFORM_FUNCTION_RE.findall(transform):
         values = [
             float(chunk)
-            for chunk in re.split(r"[,\s]+", arg_text.strip())
+            for chunk in _TRANSFORM_ARG_SPLIT_RE.split(arg_text.strip())
             if chunk
         ]
         name = fn.lower()
@@ -2669,7 +2898,7 @@ def _collect_templates(root: ET.Element, diag_ns: str) -> Dict[str, List[ET.Elem
             name = child.get("name")
             if not name:
                 continue
-            templates[name] = [deepcopy(elem) for elem in list(child)]
+            templates[name] = [_clone_element(elem) for elem in child]
         else:
             new_children.append(child)
     root[:] = new_children
@@ -2679,27 +2908,30 @@ def _collect_templates(root: ET.Element, diag_ns: str) -> Dict[str, List[ET.Elem
 def _expand_instances_in_tree(
     node: ET.Element,
     diag_ns: str,
-    templates: Dict[str, List[ET.Element]],
+    templates: Dict[str, Sequence[ET.Element]],
 ) -> None:
-    new_children: List[ET.Element] = []
-    for child in list(node):
-        ns = _namespace_of(child.tag)
-        local = _local_name(child.tag)
-        if ns == diag_ns and local == "instance":
-            expanded = _instantiate_template(child, diag_ns, templates)
-            for elem in expanded:
-                _expand_instances_in_tree(elem, diag_ns, templates)
-                new_children.append(elem)
-        else:
-            _expand_instances_in_tree(child, diag_ns, templates)
-            new_children.append(child)
-    node[:] = new_children
+    instance_tag = _qual(diag_ns, "instance")
+
+    def _walk(parent: ET.Element) -> None:
+        new_children: List[ET.Element] = []
+        for child in list(parent):
+            if child.tag == instance_tag:
+                expanded = _instantiate_template(child, diag_ns, templates)
+                for elem in expanded:
+                    _walk(elem)
+                    new_children.append(elem)
+            else:
+                _walk(child)
+                new_children.append(child)
+        parent[:] = new_children
+
+    _walk(node)
 
 
 def _instantiate_template(
     instance: ET.Element,
     diag_ns: str,
-    templates: Dict[str, List[ET.Element]],
+    templates: Dict[str, Sequence[ET.Element]],
 ) -> List[ET.Element]:
     template_name = instance.get("template")
     if not template_name:
@@ -2708,22 +2940,19 @@ def _instantiate_template(
     if not blueprint:
         return []
     params = _gather_template_params(instance, diag_ns)
-    clones = [deepcopy(elem) for elem in blueprint]
+    overrides = {k: v for k, v in instance.attrib.items() if k != "template"}
+    clones = [_clone_element(elem) for elem in blueprint]
     for clone in clones:
-        for attr_key, attr_value in instance.attrib.items():
-            if attr_key == "template":
-                continue
-            clone.set(attr_key, attr_value)
+        clone.attrib.update(overrides)
         _apply_template_params(clone, params, diag_ns)
     return clones
 
 
 def _gather_template_params(node: ET.Element, diag_ns: str) -> Dict[str, str]:
     params: Dict[str, str] = {}
-    for child in list(node):
-        ns = _namespace_of(child.tag)
-        local = _local_name(child.tag)
-        if ns == diag_ns and local == "param":
+    param_tag = _qual(diag_ns, "param")
+    for child in node:
+        if child.tag == param_tag:
             name = child.get("name")
             if not name:
                 continue
@@ -2735,62 +2964,28 @@ def _gather_template_params(node: ET.Element, diag_ns: str) -> Dict[str, str]:
 def _apply_template_params(
     node: ET.Element, params: Dict[str, str], diag_ns: str
 ) -> None:
-    children = list(node)
-    for idx, child in enumerate(children):
-        ns = _namespace_of(child.tag)
-        local = _local_name(child.tag)
-        if ns == diag_ns and local == "slot":
-            name = child.get("name")
-            value = params.get(name, "")
-            parent = node
-            parent.remove(child)
-            if idx == 0:
-                parent.text = (parent.text or "") + value
-            else:
-                prev = children[idx - 1]
-                prev.tail = (prev.tail or "") + value
+    slot_tag = _qual(diag_ns, "slot")
+
+    # Each parent only rewrites its own text and its children's tails, so
+    # visiting order does not matter.
+    stack = [node]
+    while stack:
+        parent = stack.pop()
+        if not len(parent):
             continue
-        _apply_template_params(child, params, diag_ns)
-
-
-def _merge_bbox(
-    current: Optional[Tuple[float, float, float, float]],
-    new: Optional[Tuple[float, float, float, float]],
-) -> Optional[Tuple[float, float, float, float]]:
-    if new is None:
-        return current
-    if current is None:
-        return new
-    return (
-        min(current[0], new[0]),
-        min(current[1], new[1]),
-        max(current[2], new[2]),
-        max(current[3], new[3]),
-    )
-
-
-def _apply_root_bounds(
-    src_root: ET.Element,
-    svg_root: ET.Element,
-    bbox: Optional[Tuple[float, float, float, float]],
-) -> None:
-    if bbox is None:
-        return
-    raw_min_x, raw_min_y, raw_max_x, raw_max_y = bbox
-    min_x = raw_min_x
-    min_y = raw_min_y
-    max_x = raw_max_x
-    max_y = raw_max_y
-    width_needed = max(max_x - min_x, 0.0)
-    height_needed = max(max_y - min_y, 0.0)
-    if width_needed == 0.0 and height_needed == 0.0:
-        return
-    svg_root.set(
-        "viewBox",
-        f"{_fmt(min_x)} {_fmt(min_y)} {_fmt(width_needed)} {_fmt(height_needed)}",
-    )
-    _ensure_dimension(svg_root, "width", width_needed, src_root.get("width"))
-    _ensure_dimension(svg_root, "height", height_needed, src_root.get("height"))
+        children = list(parent)
+        for idx, child in enumerate(children):
+            if child.tag == slot_tag:
+                name = child.get("name")
+                value = params.get(name, "")
+                parent.remove(child)
+                if idx == 0:
+                    parent.text = (parent.text or "") + value
+                else:
+                    prev = children[idx - 1]
+                    prev.tail = (prev.tail or "") + value
+                continue
+            stack.append(child)
 
 
 def _apply_resvg_bounds(
@@ -2800,8 +2995,9 @@ def _apply_resvg_bounds(
     font_paths: List[str],
     diagram_padding: float = 0.0,
 ) -> None:
-    svg_text = ET.tostring(svg_root, encoding="unicode")
-    measurement = _measure_svg(svg_text, font_paths)
+    # resvg parses UTF-8 bytes, so skip the intermediate unicode string.
+    svg_data = ET.tostring(svg_root, encoding="utf-8")
+    measurement = _measure_svg(svg_data, font_paths)
     overall = measurement.get("overall")
     if not overall:
         return
@@ -2842,7 +3038,7 @@ def _apply_background_rect(
 
     view_box = svg_root.get("viewBox")
     if view_box:
-        parts = re.split(r"[ ,]+", view_box.strip())
+        parts = view_box.replace(",", " ").split()
         if len(parts) >= 4:
             try:
                 min_x = float(parts[0])
@@ -2869,7 +3065,7 @@ def _apply_background_rect(
         "height": _fmt(height),
         "fill": color,
     }
-    svg_root.insert(0, ET.Element(_q("rect"), rect_attrs))
+    svg_root.insert(0, ET.Element(_RECT_TAG, rect_attrs))
 
 
 def _ensure_dimension(
@@ -2885,17 +3081,35 @@ def _ensure_dimension(
         svg_root.set(attr, _fmt(max(needed, 0.0)))
 
 
-def _clone_without_diag(node: ET.Element, diag_ns: str) -> ET.Element:
-    clone = deepcopy(node)
-    for elem in clone.iter():
-        keys = [k for k in elem.attrib if _namespace_of(k) == diag_ns]
-        for key in keys:
-            del elem.attrib[key]
+def _clone_element(elem: ET.Element) -> ET.Element:
+    # Equivalent to deepcopy for ElementTree nodes (tag, text and attribute
+    # values are immutable strings) without the memo bookkeeping.
+    clone = ET.Element(elem.tag, elem.attrib)
+    clone.text = elem.text
+    clone.tail = elem.tail
+    clone.extend([_clone_element(child) for child in elem])
     return clone
 
 
+def _clone_without_diag(node: ET.Element, diag_ns: str) -> ET.Element:
+    diag_prefix = _qual(diag_ns, "")
+
+    def _copy(elem: ET.Element) -> ET.Element:
+        clone = ET.Element(
+            elem.tag,
+            {k: v for k, v in elem.attrib.items() if not k.startswith(diag_prefix)},
+        )
+        clone.text = elem.text
+        clone.tail = elem.tail
+        clone.extend([_copy(child) for child in elem])
+        return clone
+
+    return _copy(node)
+
+
 def _filtered_attrib(attrib, diag_ns: str):
-    return {k: v for k, v in attrib.items() if _namespace_of(k) != diag_ns}
+    diag_prefix = _qual(diag_ns, "")
+    return {k: v for k, v in attrib.items() if not k.startswith(diag_prefix)}
 
 
 def _render_generic_node(
@@ -2909,7 +3123,8 @@ def _render_generic_node(
     clone = ET.Element(node.tag, _filtered_attrib(node.attrib, diag_ns))
     if node.text:
         clone.text = node.text
-    for child in list(node):
+    rendered_children: List[ET.Element] = []
+    for child in node:
         child_rendered, _, _, _ = _render_node(
             child,
             diag_ns,
@@ -2917,28 +3132,46 @@ def _render_generic_node(
             inherited_family=inherited_family,
             inherited_path=inherited_path,
             class_style_rules=class_style_rules,
+            measure=False,
         )
         if child_rendered is not None:
-            clone.append(child_rendered)
             child_rendered.tail = child.tail
+            rendered_children.append(child_rendered)
+    clone.extend(rendered_children)
     return clone
 
 
 def _pretty_xml(element: ET.Element) -> str:
-    try:
-        for text_node in element.iter(_q("text")):
-            if text_node.text:
-                text_node.text = text_node.text.strip()
-    except Exception:
-        pass
-    try:
-        ET.indent(element, space="  ")
-    except AttributeError:
-        # Python <3.9 doesn't have ET.indent; fall back to raw serialization.
-        pass
+    _indent_tree(element)
     return ET.tostring(element, encoding="unicode")
 
 
+def _indent_tree(element: ET.Element) -> None:
+    # Same result as stripping <text> content and then calling ET.indent(space="  "),
+    # but done in a single walk over the tree.
+    indentations = ["\n"]
+
+    def _walk(elem: ET.Element, level: int) -> None:
+        if elem.tag == _TEXT_TAG and elem.text:
+            elem.text = elem.text.strip()
+        if not len(elem):
+            return
+        child_level = level + 1
+        if child_level == len(indentations):
+            indentations.append(indentations[level] + "  ")
+        child_indentation = indentations[child_level]
+        if not elem.text or not elem.text.strip():
+            elem.text = child_indentation
+        for child in elem:
+            _walk(child, child_level)
+            if not child.tail or not child.tail.strip():
+                child.tail = child_indentation
+        if not child.tail.strip():
+            child.tail = indentations[level]
+
+    _walk(element, 0)
+
+
 def _apply_font_attribute(elem: ET.Element, font_family: Optional[str]) -> None:
     if not font_family:
         return
@@ -2956,7 +3189,7 @@ def _infer_font_size(node: ET.Element, class_style_rules: List[_ClassStyleRule])
         return _parse_length(node.attrib["font-size"], 16.0)
     style = node.get("style")
     if style:
-        match = re.search(r"font-size:\s*([0-9.]+)", style)
+        match = _FONT_SIZE_STYLE_RE.search(style)
         if match:
             return float(match.group(1))
     class_font_size = _class_style_value(node, class_style_rules, "font-size")
@@ -2978,7 +3211,7 @@ def _font_family_info(
     if not family:
         style = node.get("style")
         if style:
-            match = re.search(r"font-family:\s*([^;]+)", style)
+            match = _FONT_FAMILY_STYLE_RE.search(style)
             if match:
                 family = match.group(1)
     if not family:
@@ -2990,11 +3223,11 @@ def _font_family_info(
 
 def _collect_class_style_rules(root: ET.Element) -> List[_ClassStyleRule]:
     rules: List[_ClassStyleRule] = []
-    for style_node in root.iter(_q("style")):
+    for style_node in root.iter(_STYLE_TAG):
         css_text = "".join(style_node.itertext())
         if not css_text:
             continue
-        for selector_text, body in re.findall(r"([^{}]+)\{([^{}]*)\}", css_text, flags=re.MULTILINE):
+        for selector_text, body in _CSS_RULE_RE.findall(css_text):
             declarations: Dict[str, str] = {}
             for decl in body.split(";"):
                 if ":" not in decl:
@@ -3006,13 +3239,10 @@ def _collect_class_style_rules(root: ET.Element) -> List[_ClassStyleRule]:
                     declarations[key] = value
             if not declarations:
                 continue
-            selectors = [s.strip() for s in selector_text.split(",") if s.strip()]
-            for selector in selectors:
-                # Support simple class selectors like `.x` or `text.x`.
-                for class_name in re.findall(r"\.([A-Za-z_][A-Za-z0-9_-]*)", selector):
-                    rules.append(
-                        _ClassStyleRule(class_name=class_name, declarations=declarations.copy())
-                    )
+            # Support simple class selectors like `.x` or `text.x`; one scan covers the
+            # whole selector group and rules share the read-only declarations dict.
+            for class_name in _CSS_CLASS_RE.findall(selector_text):
+                rules.append(_ClassStyleRule(class_name=class_name, declarations=declarations))
     return rules
 
 
@@ -3033,12 +3263,13 @@ def _class_style_value(
 
 
 def _collect_font_paths(node: ET.Element, diag_ns: str) -> List[str]:
-    paths: set[str] = set()
+    raw_paths: set[str] = set()
+    font_path_key = _qual(diag_ns, "font-path")
     for elem in node.iter():
-        diag_font_path = elem.get(_qual(diag_ns, "font-path"))
+        diag_font_path = elem.get(font_path_key)
         if diag_font_path:
-            paths.add(str(Path(diag_font_path).expanduser()))
-    return sorted(paths)
+            raw_paths.add(diag_font_path)
+    return sorted({str(Path(raw).expanduser()) for raw in raw_paths})
 
 
 def _gather_text(node: ET.Element) -> str:
@@ -3054,15 +3285,34 @@ def _estimate_text_width(
     return _TEXT_MEASURER.measure(text, font_size, font_family, font_path)
 
 
+def _heuristic_char_factor(ch: str) -> float:
+    if ch.isspace():
+        return 0.33
+    if ch in "il":
+        return 0.3
+    if ch in "mwMW@#":
+        return 0.9
+    return 0.6
+
+
+# Per-codepoint width factors for Latin-1; anything above falls back to the
+# whitespace/default split in `_heuristic_width`.
+_HEURISTIC_WIDTH_FACTORS: Tuple[float, ...] = tuple(
+    _heuristic_char_factor(chr(code)) for code in range(256)
+)
+
+
 def _heuristic_width(text: str, font_size: float) -> float:
+    # Accumulate per character (not sum * size) so rounding matches the
+    # original loop exactly; wrap breaks at the width limit depend on it.
+    factors = _HEURISTIC_WIDTH_FACTORS
     width = 0.0
     for ch in text:
-        if ch.isspace():
+        code = ord(ch)
+        if code < 256:
+            width += font_size * factors[code]
+        elif ch.isspace():
             width += font_size * 0.33
-        elif ch in "il":
-            width += font_size * 0.3
-        elif ch in "mwMW@#":
-            width += font_size * 0.9
         else:
             width += font_size * 0.6
     return width
@@ -3079,25 +3329,36 @@ def _strip_quotes(value: str) -> str:
 def _parse_length(value: Optional[str], default: Optional[float]) -> Optional[float]:
     if value is None:
         return default
-    match = re.match(r"^-?\d+(?:\.\d+)?", value)
+    if value.isascii() and value.isdigit():
+        # Bare integers (the common case for x/y/width/gap) need no regex.
+        return float(value)
+    match = _LENGTH_RE.match(value)
     if match:
         return float(match.group(0))
     return default
 
 
 def _fmt(value: float) -> str:
-    if math.isclose(value, round(value)):
-        return str(int(round(value)))
-    return f"{value:.3f}".rstrip("0").rstrip(".")
+    if value.__class__ is int:
+        return str(value)
+    text = f"{value:.3f}"
+    if text.endswith(".000"):
+        text = text[:-4]
+        return "0" if text == "-0" else text
+    return text.rstrip("0")
 
 
 def _copy_svg_attributes(src: ET.Element, dest: ET.Element, diag_ns: str) -> None:
+    diag_prefix = _qual(diag_ns, "")
     for key, value in src.attrib.items():
-        if _namespace_of(key) == diag_ns:
+        if key.startswith(diag_prefix):
             continue
         dest.set(_local_name(key), value)
 
 
+# Only a handful of distinct tags and attribute names occur per document, so
+# the split results are memoized.
+@lru_cache(maxsize=256)
 def _namespace_of(tag: str) -> Optional[str]:
     if tag is None:
         return None
@@ -3106,6 +3367,7 @@ def _namespace_of(tag: str) -> Optional[str]:
     return None
 
 
+@lru_cache(maxsize=256)
 def _local_name(tag: str) -> str:
     if tag.startswith("{"):
         return tag.split("}", 1)[1]
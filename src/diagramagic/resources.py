@@ -1,21 +1,24 @@
+from functools import lru_cache
 from importlib import resources
 
+_DATA = resources.files(__package__).joinpath("data")
 
+
+@lru_cache(maxsize=1)
 def load_cheatsheet() -> str:
-    with resources.files(__package__).joinpath("data/AGENTS.md").open("r", encoding="utf-8") as fh:
-        return fh.read()
+    return _DATA.joinpath("AGENTS.md").read_text(encoding="utf-8")
 
 
+@lru_cache(maxsize=1)
 def load_patterns() -> str:
-    with resources.files(__package__).joinpath("data/diagramagic_patterns.md").open("r", encoding="utf-8") as fh:
-        return fh.read()
+    return _DATA.joinpath("diagramagic_patterns.md").read_text(encoding="utf-8")
 
 
+@lru_cache(maxsize=1)
 def load_prompt() -> str:
-    with resources.files(__package__).joinpath("data/diagramagic_prompt.txt").open("r", encoding="utf-8") as fh:
-        return fh.read()
+    return _DATA.joinpath("diagramagic_prompt.txt").read_text(encoding="utf-8")
 
 
+@lru_cache(maxsize=1)
 def load_skill() -> str:
-    with resources.files(__package__).joinpath("data/diagramagic_skill.md").open("r", encoding="utf-8") as fh:
-        return fh.read()
+    return _DATA.joinpath("diagramagic_skill.md").read_text(encoding="utf-8")
@@ -7,14 +7,23 @@ use resvg::usvg;
 use usvg::NodeExt;
 use usvg_text_layout::{fontdb, TreeTextToPath};
 
+/// Borrow SVG source passed either as `str` or as UTF-8 `bytes`.
+fn svg_source_bytes(svg_data: &PyAny) -> PyResult<&[u8]> {
+    if let Ok(raw) = svg_data.downcast::<PyBytes>() {
+        return Ok(raw.as_bytes());
+    }
+    Ok(svg_data.extract::<&str>()?.as_bytes())
+}
+
 #[pyfunction]
 #[pyo3(signature = (svg_text, font_paths=None))]
 fn measure_svg(
     py: Python,
-    svg_text: &str,
+    svg_text: &PyAny,
     font_paths: Option<Vec<String>>,
 ) -> PyResult<PyObject> {
-    let result = measure_internal(svg_text, font_paths).map_err(|e| {
+    let svg_data = svg_source_bytes(svg_text)?;
+    let result = measure_internal(svg_data, font_paths).map_err(|e| {
         PyValueError::new_err(e.to_string())
     })?;
 
@@ -126,7 +135,7 @@ enum MeasureError {
 }
 
 fn measure_internal(
-    svg_text: &str,
+    svg_data: &[u8],
     font_paths: Option<Vec<String>>,
 ) -> Result<MeasureResult, MeasureError> {
     let opt = usvg::Options::default();
@@ -140,7 +149,7 @@ fn measure_internal(
         }
     }
 
-    let mut rtree = usvg::Tree::from_data(svg_text.as_bytes(), &opt).map_err(|e| {
+    let mut rtree = usvg::Tree::from_data(svg_data, &opt).map_err(|e| {
         MeasureError::Parse(format!("{:?}", e))
     })?;
     rtree.convert_text(&db);
@@ -1,13 +1,68 @@
 """Run acceptance tests for diagramagic."""
 from __future__ import annotations
 
+import argparse
+import io
+import os
 import sys
 import unittest
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
 
 
-def main() -> int:
+def _test_ids(suite: unittest.TestSuite) -> List[str]:
+    ids: List[str] = []
+    for item in suite:
+        if isinstance(item, unittest.TestSuite):
+            ids.extend(_test_ids(item))
+        else:
+            ids.append(item.id())
+    return ids
+
+
+def _run_chunk(test_ids: List[str]) -> Tuple[int, int, int, str]:
+    # Each worker is its own interpreter, so sys.stdout patching and class
+    # scratch directories in the tests never collide across chunks.
+    stream = io.StringIO()
+    suite = unittest.defaultTestLoader.loadTestsFromNames(test_ids)
+    result = unittest.TextTestRunner(stream=stream, verbosity=2).run(suite)
+    return result.testsRun, len(result.failures), len(result.errors), stream.getvalue()
+
+
+def _run_parallel(suite: unittest.TestSuite, jobs: int) -> int:
+    ids = _test_ids(suite)
+    chunks = [ids[i::jobs] for i in range(jobs) if ids[i::jobs]]
+    total = failures = errors = 0
+    with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+        for ran, failed, errored, output in pool.map(_run_chunk, chunks):
+            sys.stderr.write(output)
+            total += ran
+            failures += failed
+            errors += errored
+    sys.stderr.write(f"\nRan {total} tests in {len(chunks)} worker processes\n")
+    if failures or errors:
+        sys.stderr.write(f"FAILED (failures={failures}, errors={errors})\n")
+        return 1
+    sys.stderr.write("OK\n")
+    return 0
+
+
+def main(argv: Optional[Iterable[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Worker processes to spread tests across (0 = one per CPU)",
+    )
+    args = parser.parse_args(list(argv) if argv is not None else None)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+
     suite = unittest.defaultTestLoader.discover(start_dir=str(Path(__file__).resolve().parent), pattern="test_*.py")
+    if jobs > 1 and suite.countTestCases():
+        return _run_parallel(suite, jobs)
     result = unittest.TextTestRunner(verbosity=2).run(suite)
     return 0 if result.wasSuccessful() else 1
 
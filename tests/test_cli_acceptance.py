@@ -2,54 +2,166 @@ from __future__ import annotations
 
 import io
 import json
+import os
 import re
 import subprocess
 import sys
 import tempfile
 import unittest
-import xml.etree.ElementTree as ET
+from functools import cached_property
 from pathlib import Path
 from unittest import mock
 
+try:  # libxml2-backed parsing when available; only the shared ElementTree API is used.
+    from lxml import etree as ET
+except ImportError:  # pragma: no cover - stdlib fallback
+    import xml.etree.ElementTree as ET
+
 TESTS_DIR = Path(__file__).resolve().parent
 PROJECT_ROOT = TESTS_DIR.parent
-sys.path.insert(0, str(PROJECT_ROOT / "src"))
+SRC_DIR = str(PROJECT_ROOT / "src")
+
+# Scratch files are tiny and short-lived; keep them in RAM where tmpfs exists.
+_SCRATCH_PARENT = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+
+_TRANSLATE_X_RE = re.compile(r"translate\(([-0-9.]+),")
+_TRANSLATE_XY_RE = re.compile(r"translate\(([-0-9.]+),\s*([-0-9.]+)\)")
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+_ROOT_HEIGHT_RE = re.compile(r'<svg\b[^>]*?\sheight="([-0-9.]+)"')
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Minimal 1x1 PNG handed back by _stub_raster().
+_STUB_PNG = (
+    _PNG_SIGNATURE
+    + b"\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89"
+    + b"\x00\x00\x00\x0bIDATx\x9cc`\x00\x02\x00\x00\x05\x00\x01z^\xab?"
+    + b"\x00\x00\x00\x00IEND\xaeB`\x82"
+)
+_ROTATE_RE = re.compile(r"^\s*rotate\(\s*(-?\d+(?:\.\d+)?)")
+
+_NS = {"svg": "http://www.w3.org/2000/svg"}
+
+_DIAG_NS = "https://diagramagic.ai/ns"
+_EXAMPLE_DIAG_NS = "https://example.com/diag"
 
-from diagramagic import cli
+
+def _diag(body: str, ns: str = _DIAG_NS) -> str:
+    return f'<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="{ns}">{body}</diag:diagram>'
+
+
+def _rotate_angle(transform: str | None) -> float | None:
+    match = _ROTATE_RE.match(transform or "")
+    return float(match.group(1)) if match else None
+
+
+# Two flex nodes side by side; shared by the arrow tests.
+_NODES_A_B = """
+  <diag:flex id="a" x="20" y="20" width="120" padding="8"><text style="font-size:12px">A</text></diag:flex>
+  <diag:flex id="b" x="260" y="20" width="120" padding="8"><text style="font-size:12px">B</text></diag:flex>
+"""
+
+# Arrow bounds fixture pair: identical except for the thick arrow.
+_ARROW_BOUNDS_WITHOUT = _diag(_NODES_A_B)
+_ARROW_BOUNDS_WITH = _diag(_NODES_A_B + '  <diag:arrow from="a" to="b" stroke-width="24"/>\n')
+
+# One node over the graph size limit; built once at import.
+_TOO_LARGE_GRAPH_SRC = _diag(
+    "<diag:graph>"
+    + "".join(
+        f'<diag:node id="n{i}"><text style="font-size:12px">N{i}</text></diag:node>'
+        for i in range(2001)
+    )
+    + "</diag:graph>"
+)
 
 
 class _StdoutCapture:
     def __init__(self) -> None:
-        self._text = io.StringIO()
-        self.buffer = io.BytesIO()
+        self._chunks: list[str] = []
+
+    @cached_property
+    def buffer(self) -> io.BytesIO:
+        # Only PNG --stdout writes go through the binary buffer.
+        return io.BytesIO()
 
     def write(self, value: str) -> int:
-        return self._text.write(value)
+        self._chunks.append(value)
+        return len(value)
 
     def flush(self) -> None:
         pass
 
     def get_text(self) -> str:
-        return self._text.getvalue()
+        return "".join(self._chunks)
+
+    def get_bytes(self) -> bytes:
+        return self.buffer.getvalue() if "buffer" in self.__dict__ else b""
 
 
 class CLIAcceptanceTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        # parse_args does not mutate the parser, so one instance serves every test.
+        # Importing the compiler stack is deferred until the class actually runs,
+        # so test collection stays cheap.
+        if SRC_DIR not in sys.path:
+            sys.path.insert(0, SRC_DIR)
+        from diagramagic import cli, diagramagic
+
+        cls.cli = cli
+        cls.compile_svgpp = staticmethod(diagramagic)
+        cls._parser = cli._build_parser()
+        cls._scratch_root = tempfile.TemporaryDirectory(dir=_SCRATCH_PARENT)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls._scratch_root.cleanup()
+
+    def scratch_dir(self) -> str:
+        # Fresh per-test directory; everything is removed once in tearDownClass.
+        return tempfile.mkdtemp(dir=self._scratch_root.name)
+
+    @staticmethod
+    def _stub_raster():
+        # For render tests that check what reaches the rasterizer, not its pixels.
+        return mock.patch("diagramagic.diagramagic._render_svg", return_value=_STUB_PNG)
+
     @staticmethod
     def _png_size(blob: bytes) -> tuple[int, int]:
         # PNG IHDR width/height are big-endian u32 at fixed offsets.
-        if len(blob) < 24 or blob[:8] != b"\x89PNG\r\n\x1a\n":
+        if len(blob) < 24 or blob[:8] != _PNG_SIGNATURE:
             raise AssertionError("not a PNG payload")
         width = int.from_bytes(blob[16:20], "big")
         height = int.from_bytes(blob[20:24], "big")
         return width, height
 
-    def run_cli(self, argv: list[str], stdin_text: str = "") -> tuple[int, str, bytes, str]:
+    @staticmethod
+    def _root_height(svg_text: str) -> float:
+        # Reads the root <svg> height without parsing the whole document.
+        match = _ROOT_HEIGHT_RE.search(svg_text)
+        if match is None:
+            raise AssertionError("root <svg> has no height attribute")
+        return float(match.group(1))
+
+    @staticmethod
+    def _captured(call, stdin_text: str = "") -> tuple[int, str, bytes, str]:
         stdout = _StdoutCapture()
         stderr = io.StringIO()
         stdin = io.StringIO(stdin_text)
-        with mock.patch("sys.stdout", stdout), mock.patch("sys.stderr", stderr), mock.patch("sys.stdin", stdin):
-            code = cli.main(argv)
-        return code, stdout.get_text(), stdout.buffer.getvalue(), stderr.getvalue()
+        saved = sys.stdout, sys.stderr, sys.stdin
+        sys.stdout, sys.stderr, sys.stdin = stdout, stderr, stdin
+        try:
+            code = call()
+        finally:
+            sys.stdout, sys.stderr, sys.stdin = saved
+        return code, stdout.get_text(), stdout.get_bytes(), stderr.getvalue()
+
+    def run_cli(self, argv: list[str], stdin_text: str = "") -> tuple[int, str, bytes, str]:
+        return self._captured(lambda: self.cli.main(argv, parser=self._parser), stdin_text)
+
+    def run_compile(self, text: str, **fields) -> tuple[int, str, bytes, str]:
+        # Equivalent to `compile --text TEXT --stdout`, minus argument parsing.
+        cmd = self.cli.CompileCommand(text=text, stdout=True, **fields)
+        return self._captured(lambda: self.cli.execute_compile(cmd))
 
     def test_requires_subcommand(self) -> None:
         code, _out, _png, err = self.run_cli([])
@@ -58,40 +170,38 @@ class CLIAcceptanceTests(unittest.TestCase):
         self.assertIn("subcommand", err)
 
     def test_compile_file_writes_svg(self) -> None:
-        with tempfile.TemporaryDirectory() as td:
-            src = Path(td) / "input.svg++"
-            src.write_text(
-                """
-<diag:diagram xmlns=\"http://www.w3.org/2000/svg\" xmlns:diag=\"https://example.com/diag\">
+        td = self.scratch_dir()
+        src = Path(td) / "input.svg++"
+        src.write_text(
+            _diag("""
   <diag:flex width=\"160\" padding=\"10\" background-class=\"card\"><text style=\"font-size:12px\">Hello</text></diag:flex>
-</diag:diagram>
-""".strip()
-            )
-            code, out, _png, err = self.run_cli(["compile", str(src)])
-            self.assertEqual(code, 0, err)
-            target = Path(td) / "input.svg"
-            self.assertTrue(target.exists())
-            self.assertIn("Wrote", out)
+""", ns=_EXAMPLE_DIAG_NS)
+        )
+        code, out, _png, err = self.run_cli(["compile", str(src)])
+        self.assertEqual(code, 0, err)
+        target = Path(td) / "input.svg"
+        self.assertTrue(target.exists())
+        self.assertIn("Wrote", out)
 
     def test_render_svgpp_and_raw_svg(self) -> None:
-        with tempfile.TemporaryDirectory() as td:
-            svgpp = Path(td) / "diagram.svg++"
-            svgpp.write_text(
-                """
-<diag:diagram xmlns=\"http://www.w3.org/2000/svg\" xmlns:diag=\"https://example.com/diag\">
+        td = self.scratch_dir()
+        svgpp = Path(td) / "diagram.svg++"
+        svgpp.write_text(
+            _diag("""
   <diag:flex width=\"120\" padding=\"8\"><text style=\"font-size:12px\">Ping</text></diag:flex>
-</diag:diagram>
-""".strip()
-            )
-            code, _out, _png, err = self.run_cli(["render", str(svgpp)])
-            self.assertEqual(code, 0, err)
-            self.assertTrue((Path(td) / "diagram.png").exists())
+""", ns=_EXAMPLE_DIAG_NS)
+        )
+        code, out, _png, err = self.run_cli(["render", str(svgpp)])
+        self.assertEqual(code, 0, err)
+        target = Path(td) / "diagram.png"
+        self.assertTrue(target.exists())
+        self.assertGreater(target.stat().st_size, 0)
+        self.assertIn("Wrote", out)
 
-            raw = Path(td) / "raw.svg"
-            raw.write_text('<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20"><rect x="0" y="0" width="20" height="20"/></svg>')
-            code, _out, _png, err = self.run_cli(["render", str(raw)])
-            self.assertEqual(code, 0, err)
-            self.assertTrue((Path(td) / "raw.png").exists())
+        raw = '<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20"><rect x="0" y="0" width="20" height="20"/></svg>'
+        code, _out, png, err = self.run_cli(["render", "--text", raw, "--stdout"])
+        self.assertEqual(code, 0, err)
+        self.assertEqual(self._png_size(png), (20, 20))
 
     def test_render_stdout_and_scale(self) -> None:
         svg = '<svg xmlns="http://www.w3.org/2000/svg" width="40" height="20"><rect x="0" y="0" width="40" height="20"/></svg>'
@@ -105,279 +215,217 @@ class CLIAcceptanceTests(unittest.TestCase):
         w2, h2 = self._png_size(png2)
         self.assertEqual((w2, h2), (80, 40))
 
-    def test_focus_missing_id_errors(self) -> None:
-        with tempfile.TemporaryDirectory() as td:
-            raw = Path(td) / "raw.svg"
-            raw.write_text('<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20"><rect id="ok" x="0" y="0" width="20" height="20"/></svg>')
-            code, _out, _png, err = self.run_cli(["render", str(raw), "--focus", "missing"])
-            self.assertEqual(code, 4)
-            self.assertIn("E_FOCUS_NOT_FOUND", err)
-
-    def test_focus_off_canvas_succeeds(self) -> None:
-        with tempfile.TemporaryDirectory() as td:
-            raw = Path(td) / "raw.svg"
-            raw.write_text(
-                '<svg xmlns="http://www.w3.org/2000/svg" width="100" height="100">'
-                '<rect id="far" x="1000" y="1000" width="20" height="20"/></svg>'
-            )
-            code, _out, _png, err = self.run_cli(["render", str(raw), "--focus", "far", "--padding", "10"])
-            self.assertEqual(code, 0, err)
-            self.assertTrue((Path(td) / "raw.png").exists())
+    def test_focus_cases(self) -> None:
+        raw = (
+            '<svg xmlns="http://www.w3.org/2000/svg" width="100" height="100">'
+            '<rect id="ok" x="0" y="0" width="20" height="20"/>'
+            '<rect id="far" x="1000" y="1000" width="20" height="20"/></svg>'
+        )
+        # (focus args, expected exit code, expected error code or None on success)
+        cases = [
+            (["--focus", "missing"], 4, "E_FOCUS_NOT_FOUND"),
+            (["--focus", "far", "--padding", "10"], 0, None),
+        ]
+        for extra, expected_code, expected_err in cases:
+            with self.subTest(args=extra), self._stub_raster() as raster:
+                code, _out, png, err = self.run_cli(["render", "--text", raw, "--stdout", *extra])
+                self.assertEqual(code, expected_code, err)
+                if expected_err:
+                    self.assertIn(expected_err, err)
+                    raster.assert_not_called()
+                else:
+                    self.assertEqual(png, _STUB_PNG)
+                    cropped = ET.fromstring(raster.call_args.args[0])
+                    self.assertEqual(cropped.get("viewBox").split()[:2], ["990", "990"])
 
     def test_templates_precedence_last_shared_wins_and_local_override(self) -> None:
-        with tempfile.TemporaryDirectory() as td:
-            t1 = Path(td) / "t1.svg++"
-            t2 = Path(td) / "t2.svg++"
-            diagram = Path(td) / "diagram.svg++"
-            t1.write_text(
-                """
-<diag:diagram xmlns=\"http://www.w3.org/2000/svg\" xmlns:diag=\"https://example.com/diag\">
+        td = self.scratch_dir()
+        t1 = Path(td) / "t1.svg++"
+        t2 = Path(td) / "t2.svg++"
+        diagram = Path(td) / "diagram.svg++"
+        t1.write_text(
+            _diag("""
   <diag:template name=\"card\"><diag:flex width=\"100\" background-class=\"v1\"><text>one</text></diag:flex></diag:template>
-</diag:diagram>
-""".strip()
-            )
-            t2.write_text(
-                """
-<diag:diagram xmlns=\"http://www.w3.org/2000/svg\" xmlns:diag=\"https://example.com/diag\">
+""", ns=_EXAMPLE_DIAG_NS)
+        )
+        t2.write_text(
+            _diag("""
   <diag:template name=\"card\"><diag:flex width=\"100\" background-class=\"v2\"><text>two</text></diag:flex></diag:template>
-</diag:diagram>
-""".strip()
-            )
-            diagram.write_text(
-                """
-<diag:diagram xmlns=\"http://www.w3.org/2000/svg\" xmlns:diag=\"https://example.com/diag\">
+""", ns=_EXAMPLE_DIAG_NS)
+        )
+        diagram.write_text(
+            _diag("""
   <diag:instance template=\"card\" />
-</diag:diagram>
-""".strip()
-            )
+""", ns=_EXAMPLE_DIAG_NS)
+        )
 
-            out_svg = Path(td) / "out.svg"
-            code, _out, _png, err = self.run_cli([
-                "compile", str(diagram), "-o", str(out_svg), "--templates", str(t1), str(t2)
-            ])
-            self.assertEqual(code, 0, err)
-            text = out_svg.read_text()
-            self.assertIn('class="v2"', text)
-
-            local = Path(td) / "local.svg++"
-            local.write_text(
-                """
-<diag:diagram xmlns=\"http://www.w3.org/2000/svg\" xmlns:diag=\"https://example.com/diag\">
+        out_svg = Path(td) / "out.svg"
+        code, _out, _png, err = self.run_cli([
+            "compile", str(diagram), "-o", str(out_svg), "--templates", str(t1), str(t2)
+        ])
+        self.assertEqual(code, 0, err)
+        text = out_svg.read_text()
+        self.assertIn('class="v2"', text)
+
+        local = Path(td) / "local.svg++"
+        local.write_text(
+            _diag("""
   <diag:template name=\"card\"><diag:flex width=\"100\" background-class=\"local\"><text>local</text></diag:flex></diag:template>
   <diag:instance template=\"card\" />
-</diag:diagram>
-""".strip()
-            )
-            out_svg2 = Path(td) / "out2.svg"
-            code, _out, _png, err = self.run_cli([
-                "compile", str(local), "-o", str(out_svg2), "--templates", str(t1), str(t2)
-            ])
-            self.assertEqual(code, 0, err)
-            self.assertIn('class="local"', out_svg2.read_text())
+""", ns=_EXAMPLE_DIAG_NS)
+        )
+        out_svg2 = Path(td) / "out2.svg"
+        code, _out, _png, err = self.run_cli([
+            "compile", str(local), "-o", str(out_svg2), "--templates", str(t1), str(t2)
+        ])
+        self.assertEqual(code, 0, err)
+        self.assertIn('class="local"', out_svg2.read_text())
 
     def test_render_with_templates_for_svgpp(self) -> None:
-        with tempfile.TemporaryDirectory() as td:
-            template = Path(td) / "cards.svg++"
-            diagram = Path(td) / "diagram.svg++"
-            template.write_text(
-                """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://example.com/diag">
+        td = self.scratch_dir()
+        template = Path(td) / "cards.svg++"
+        diagram = Path(td) / "diagram.svg++"
+        template.write_text(
+            _diag("""
   <diag:template name="card"><diag:flex width="120" padding="8"><text>templated</text></diag:flex></diag:template>
-</diag:diagram>
-""".strip()
-            )
-            diagram.write_text(
-                """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://example.com/diag">
+""", ns=_EXAMPLE_DIAG_NS)
+        )
+        diagram.write_text(
+            _diag("""
   <diag:instance template="card" />
-</diag:diagram>
-""".strip()
-            )
-            code, _out, _png, err = self.run_cli(
-                ["render", str(diagram), "--templates", str(template)]
+""", ns=_EXAMPLE_DIAG_NS)
+        )
+        with self._stub_raster() as raster:
+            code, _out, png, err = self.run_cli(
+                ["render", str(diagram), "--stdout", "--templates", str(template)]
             )
-            self.assertEqual(code, 0, err)
-            self.assertTrue((Path(td) / "diagram.png").exists())
+        self.assertEqual(code, 0, err)
+        self.assertEqual(png, _STUB_PNG)
+        self.assertIn("templated", raster.call_args.args[0])
 
     def test_include_basic_and_transform(self) -> None:
-        with tempfile.TemporaryDirectory() as td:
-            child = Path(td) / "child.svg++"
-            parent = Path(td) / "parent.svg++"
-            child.write_text(
-                """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        td = self.scratch_dir()
+        child = Path(td) / "child.svg++"
+        parent = Path(td) / "parent.svg++"
+        child.write_text(
+            _diag("""
   <diag:flex id="child_box" width="120" padding="8"><text style="font-size:12px">Child</text></diag:flex>
-</diag:diagram>
-""".strip()
-            )
-            parent.write_text(
-                """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+""")
+        )
+        parent.write_text(
+            _diag("""
   <diag:include id="inc1" src="child.svg++" x="40" y="60" scale="1.5"/>
-</diag:diagram>
-""".strip()
-            )
-            out = Path(td) / "out.svg"
-            code, _out, _png, err = self.run_cli(["compile", str(parent), "-o", str(out)])
-            self.assertEqual(code, 0, err)
-            root = ET.fromstring(out.read_text())
-            group = root.find(".//{http://www.w3.org/2000/svg}g[@id='inc1']")
-            self.assertIsNotNone(group)
-            self.assertEqual(group.get("transform"), "translate(40 60) scale(1.5)")
-            self.assertIn("Child", out.read_text())
+""")
+        )
+        code, out, _png, err = self.run_cli(["compile", str(parent), "--stdout"])
+        self.assertEqual(code, 0, err)
+        root = ET.fromstring(out)
+        group = root.find(".//svg:g[@id='inc1']", _NS)
+        self.assertIsNotNone(group)
+        self.assertEqual(group.get("transform"), "translate(40 60) scale(1.5)")
+        self.assertIn("Child", out)
 
     def test_include_inside_flex_contributes_bounds(self) -> None:
-        with tempfile.TemporaryDirectory() as td:
-            child = Path(td) / "child.svg++"
-            parent = Path(td) / "parent.svg++"
-            parent_no_include = Path(td) / "parent_no_include.svg++"
-            child.write_text(
-                """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        td = self.scratch_dir()
+        child = Path(td) / "child.svg++"
+        parent = Path(td) / "parent.svg++"
+        parent_no_include = Path(td) / "parent_no_include.svg++"
+        child.write_text(
+            _diag("""
   <diag:flex width="180" padding="10"><text style="font-size:12px">Included block with some width</text></diag:flex>
-</diag:diagram>
-""".strip()
-            )
-            parent.write_text(
-                """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+""")
+        )
+        parent.write_text(
+            _diag("""
   <diag:flex width="260" padding="10" gap="8">
     <diag:include src="child.svg++" scale="1.2"/>
     <text style="font-size:12px">After include</text>
   </diag:flex>
-</diag:diagram>
-""".strip()
-            )
-            parent_no_include.write_text(
-                """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+""")
+        )
+        parent_no_include.write_text(
+            _diag("""
   <diag:flex width="260" padding="10" gap="8">
     <text style="font-size:12px">After include</text>
   </diag:flex>
-</diag:diagram>
-""".strip()
-            )
-            out = Path(td) / "out.svg"
-            out2 = Path(td) / "out2.svg"
-            code, _stdout, _png, err = self.run_cli(["compile", str(parent), "-o", str(out)])
-            self.assertEqual(code, 0, err)
-            code, _stdout, _png, err = self.run_cli(["compile", str(parent_no_include), "-o", str(out2)])
-            self.assertEqual(code, 0, err)
-            root = ET.fromstring(out.read_text())
-            root2 = ET.fromstring(out2.read_text())
-            height = float(root.get("height"))
-            height2 = float(root2.get("height"))
-            self.assertGreater(height, height2)
-
-    def test_include_missing_file_error(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
-  <diag:include src="definitely_missing.svg++"/>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", src])
-        self.assertEqual(code, 3)
-        self.assertIn("E_INCLUDE_NOT_FOUND", err)
-
-    def test_include_invalid_root_error(self) -> None:
-        with tempfile.TemporaryDirectory() as td:
-            child = Path(td) / "child.svg++"
-            parent = Path(td) / "parent.svg++"
-            child.write_text('<svg xmlns="http://www.w3.org/2000/svg"><rect x="0" y="0" width="10" height="10"/></svg>')
-            parent.write_text(
-                """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+""")
+        )
+        code, out, _png, err = self.run_cli(["compile", str(parent), "--stdout"])
+        self.assertEqual(code, 0, err)
+        code, out2, _png, err = self.run_cli(["compile", str(parent_no_include), "--stdout"])
+        self.assertEqual(code, 0, err)
+        height = self._root_height(out)
+        height2 = self._root_height(out2)
+        self.assertGreater(height, height2)
+
+    def test_include_file_error_cases(self) -> None:
+        # (label, files written to a fresh directory, entry file, expected error code)
+        cases = [
+            (
+                "invalid_root",
+                {
+                    "child.svg++": '<svg xmlns="http://www.w3.org/2000/svg"><rect x="0" y="0" width="10" height="10"/></svg>',
+                    "parent.svg++": _diag("""
   <diag:include src="child.svg++"/>
-</diag:diagram>
-""".strip()
-            )
-            code, _out, _png, err = self.run_cli(["compile", str(parent)])
-            self.assertEqual(code, 3)
-            self.assertIn("E_INCLUDE_ROOT", err)
-
-    def test_include_cycle_error(self) -> None:
-        with tempfile.TemporaryDirectory() as td:
-            a = Path(td) / "a.svg++"
-            b = Path(td) / "b.svg++"
-            a.write_text(
-                """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+"""),
+                },
+                "parent.svg++",
+                "E_INCLUDE_ROOT",
+            ),
+            (
+                "cycle",
+                {
+                    "a.svg++": _diag("""
   <diag:include src="b.svg++"/>
-</diag:diagram>
-""".strip()
-            )
-            b.write_text(
-                """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+"""),
+                    "b.svg++": _diag("""
   <diag:include src="a.svg++"/>
-</diag:diagram>
-""".strip()
-            )
-            code, _out, _png, err = self.run_cli(["compile", str(a)])
-            self.assertEqual(code, 3)
-            self.assertIn("E_INCLUDE_CYCLE", err)
-
-    def test_include_id_collision_error(self) -> None:
-        with tempfile.TemporaryDirectory() as td:
-            child = Path(td) / "child.svg++"
-            parent = Path(td) / "parent.svg++"
-            child.write_text(
-                """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+"""),
+                },
+                "a.svg++",
+                "E_INCLUDE_CYCLE",
+            ),
+            (
+                "id_collision",
+                {
+                    "child.svg++": _diag("""
   <rect id="dup" x="0" y="0" width="20" height="20"/>
-</diag:diagram>
-""".strip()
-            )
-            parent.write_text(
-                """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+"""),
+                    "parent.svg++": _diag("""
   <rect id="dup" x="10" y="10" width="20" height="20"/>
   <diag:include src="child.svg++"/>
-</diag:diagram>
-""".strip()
-            )
-            code, _out, _png, err = self.run_cli(["compile", str(parent)])
-            self.assertEqual(code, 3)
-            self.assertIn("E_INCLUDE_ID_COLLISION", err)
-
-    def test_include_invalid_args_error(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
-  <diag:include src="x.svg++" scale="0"/>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", src])
-        self.assertEqual(code, 3)
-        self.assertIn("E_INCLUDE_ARGS", err)
+"""),
+                },
+                "parent.svg++",
+                "E_INCLUDE_ID_COLLISION",
+            ),
+        ]
+        for label, files, entry, expected in cases:
+            with self.subTest(label):
+                td = self.scratch_dir()
+                for name, content in files.items():
+                    (Path(td) / name).write_text(content)
+                code, _out, _png, err = self.run_cli(["compile", str(Path(td) / entry)])
+                self.assertEqual(code, 3)
+                self.assertIn(expected, err)
 
     def test_include_depth_error(self) -> None:
-        with tempfile.TemporaryDirectory() as td:
-            n = 12
-            for i in range(n):
-                path = Path(td) / f"n{i}.svg++"
-                if i < n - 1:
-                    path.write_text(
-                        (
-                            "<diag:diagram xmlns=\"http://www.w3.org/2000/svg\" "
-                            "xmlns:diag=\"https://diagramagic.ai/ns\">"
-                            f"<diag:include src=\"n{i+1}.svg++\"/>"
-                            "</diag:diagram>"
-                        )
-                    )
-                else:
-                    path.write_text(
-                        "<diag:diagram xmlns=\"http://www.w3.org/2000/svg\" "
-                        "xmlns:diag=\"https://diagramagic.ai/ns\">"
-                        "<diag:flex width=\"100\"><text style=\"font-size:12px\">leaf</text></diag:flex>"
-                        "</diag:diagram>"
-                    )
-            code, _out, _png, err = self.run_cli(["compile", str(Path(td) / "n0.svg++")])
-            self.assertEqual(code, 3)
-            self.assertIn("E_INCLUDE_DEPTH", err)
+        td = self.scratch_dir()
+        n = 12
+        for i in range(n):
+            path = Path(td) / f"n{i}.svg++"
+            if i < n - 1:
+                path.write_text(_diag(f'<diag:include src="n{i+1}.svg++"/>'))
+            else:
+                path.write_text(
+                    _diag('<diag:flex width="100"><text style="font-size:12px">leaf</text></diag:flex>')
+                )
+        code, _out, _png, err = self.run_cli(["compile", str(Path(td) / "n0.svg++")])
+        self.assertEqual(code, 3)
+        self.assertIn("E_INCLUDE_DEPTH", err)
 
     def test_graph_basic_layout_and_edge_rendering(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <diag:graph direction="TB" node-gap="24" rank-gap="36">
     <diag:node id="start" padding="10"><text style="font-size:12px">Start</text></diag:node>
     <diag:node id="work" padding="10"><text style="font-size:12px">Work</text></diag:node>
@@ -385,26 +433,24 @@ class CLIAcceptanceTests(unittest.TestCase):
     <diag:edge from="start" to="work" label="step1"/>
     <diag:edge from="work" to="done" stroke-dasharray="4 2"/>
   </diag:graph>
-</diag:diagram>
-""".strip()
-        code, out, _png, err = self.run_cli(["compile", "--text", src, "--stdout"])
+""")
+        code, out, _png, err = self.run_compile(src)
         self.assertEqual(code, 0, err)
         self.assertNotIn("diag:graph", out)
         root = ET.fromstring(out)
-        self.assertIsNotNone(root.find(".//{http://www.w3.org/2000/svg}g[@id='start']"))
-        self.assertIsNotNone(root.find(".//{http://www.w3.org/2000/svg}g[@id='work']"))
-        self.assertIsNotNone(root.find(".//{http://www.w3.org/2000/svg}g[@id='done']"))
-        paths = root.findall(".//{http://www.w3.org/2000/svg}path")
+        self.assertIsNotNone(root.find(".//svg:g[@id='start']", _NS))
+        self.assertIsNotNone(root.find(".//svg:g[@id='work']", _NS))
+        self.assertIsNotNone(root.find(".//svg:g[@id='done']", _NS))
+        paths = root.findall(".//svg:path", _NS)
         self.assertGreaterEqual(len(paths), 2)
         self.assertTrue(
             any((p.get("marker-end") or "").startswith("url(#diag-graph-arrow-default-") for p in paths)
         )
-        labels = root.findall(".//{http://www.w3.org/2000/svg}text")
+        labels = root.findall(".//svg:text", _NS)
         self.assertTrue(any((t.text or "").strip() == "step1" for t in labels))
 
     def test_graph_edge_label_rotate_modes(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <diag:graph layout="layered" direction="LR">
     <diag:node id="a"><text style="font-size:12px">A</text></diag:node>
     <diag:node id="b"><text style="font-size:12px">B</text></diag:node>
@@ -413,133 +459,136 @@ class CLIAcceptanceTests(unittest.TestCase):
     <diag:edge from="a" to="b" label="e2" label-rotate="vertical" stroke="#0a0"/>
     <diag:edge from="a" to="b" label="e3" label-rotate="-30" stroke="#00f"/>
   </diag:graph>
-</diag:diagram>
-""".strip()
+""")
         with mock.patch("diagramagic.diagramagic.shutil.which", return_value=None):
-            code, out, _png, err = self.run_cli(["compile", "--text", src, "--stdout"])
+            code, out, _png, err = self.run_compile(src)
         self.assertEqual(code, 0, err)
         root = ET.fromstring(out)
-        labels = [t for t in root.findall(".//{http://www.w3.org/2000/svg}text") if (t.text or "").strip() in {"e0", "e1", "e2", "e3"}]
+        labels = [t for t in root.findall(".//svg:text", _NS) if (t.text or "").strip() in {"e0", "e1", "e2", "e3"}]
         by_text = {(t.text or "").strip(): t for t in labels}
         self.assertNotIn("transform", by_text["e0"].attrib)  # default horizontal
         self.assertIn("rotate(90", by_text["e2"].get("transform", ""))
         self.assertIn("rotate(-30", by_text["e3"].get("transform", ""))
 
     def test_graph_edge_label_rotate_invalid_value_errors(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <diag:graph>
     <diag:node id="a"><text style="font-size:12px">A</text></diag:node>
     <diag:node id="b"><text style="font-size:12px">B</text></diag:node>
     <diag:edge from="a" to="b" label="x" label-rotate="weird"/>
   </diag:graph>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", src])
+""")
+        code, _out, _png, err = self.run_compile(src)
         self.assertEqual(code, 3)
         self.assertIn("E_GRAPH_ARGS", err)
 
     def test_graph_direction_rl_positions_ranks_right_to_left(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <diag:graph direction="RL">
     <diag:node id="a"><text style="font-size:12px">A</text></diag:node>
     <diag:node id="b"><text style="font-size:12px">B</text></diag:node>
     <diag:edge from="a" to="b"/>
   </diag:graph>
-</diag:diagram>
-""".strip()
-        code, out, _png, err = self.run_cli(["compile", "--text", src, "--stdout"])
+""")
+        code, out, _png, err = self.run_compile(src)
         self.assertEqual(code, 0, err)
         root = ET.fromstring(out)
-        a = root.find(".//{http://www.w3.org/2000/svg}g[@id='a']")
-        b = root.find(".//{http://www.w3.org/2000/svg}g[@id='b']")
+        a = root.find(".//svg:g[@id='a']", _NS)
+        b = root.find(".//svg:g[@id='b']", _NS)
         self.assertIsNotNone(a)
         self.assertIsNotNone(b)
-        ax = float(re.search(r"translate\(([-0-9.]+),", a.get("transform")).group(1))
-        bx = float(re.search(r"translate\(([-0-9.]+),", b.get("transform")).group(1))
+        ax = float(_TRANSLATE_X_RE.search(a.get("transform")).group(1))
+        bx = float(_TRANSLATE_X_RE.search(b.get("transform")).group(1))
         self.assertLess(bx, ax)
 
-    def test_graph_unknown_node_error(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+    def test_compile_text_error_cases(self) -> None:
+        # (label, svg++ source, expected error code); every case exits with 3.
+        cases = [
+            (
+                "include_missing_file",
+                _diag("""
+  <diag:include src="definitely_missing.svg++"/>
+"""),
+                "E_INCLUDE_NOT_FOUND",
+            ),
+            (
+                "include_invalid_args",
+                _diag("""
+  <diag:include src="x.svg++" scale="0"/>
+"""),
+                "E_INCLUDE_ARGS",
+            ),
+            (
+                "graph_unknown_node",
+                _diag("""
   <diag:graph>
     <diag:node id="ok"><text style="font-size:12px">OK</text></diag:node>
     <diag:edge from="ok" to="missing"/>
   </diag:graph>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", src])
-        self.assertEqual(code, 3)
-        self.assertIn("E_GRAPH_UNKNOWN_NODE", err)
-
-    def test_graph_duplicate_and_collision_errors(self) -> None:
-        dup_src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+"""),
+                "E_GRAPH_UNKNOWN_NODE",
+            ),
+            (
+                "graph_duplicate_node",
+                _diag("""
   <diag:graph>
     <diag:node id="dup"><text style="font-size:12px">One</text></diag:node>
     <diag:node id="dup"><text style="font-size:12px">Two</text></diag:node>
   </diag:graph>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", dup_src])
-        self.assertEqual(code, 3)
-        self.assertIn("E_GRAPH_DUPLICATE_NODE", err)
-
-        collision_src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+"""),
+                "E_GRAPH_DUPLICATE_NODE",
+            ),
+            (
+                "graph_id_collision",
+                _diag("""
   <rect id="taken" x="0" y="0" width="20" height="20"/>
   <diag:graph>
     <diag:node id="taken"><text style="font-size:12px">X</text></diag:node>
   </diag:graph>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", collision_src])
-        self.assertEqual(code, 3)
-        self.assertIn("E_GRAPH_ID_COLLISION", err)
-
-    def test_graph_self_edge_child_and_nested_errors(self) -> None:
-        self_edge = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+"""),
+                "E_GRAPH_ID_COLLISION",
+            ),
+            (
+                "graph_self_edge",
+                _diag("""
   <diag:graph>
     <diag:node id="a"><text style="font-size:12px">A</text></diag:node>
     <diag:edge from="a" to="a"/>
   </diag:graph>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", self_edge])
-        self.assertEqual(code, 3)
-        self.assertIn("E_GRAPH_SELF_EDGE", err)
-
-        bad_child = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+"""),
+                "E_GRAPH_SELF_EDGE",
+            ),
+            (
+                "graph_child_unsupported",
+                _diag("""
   <diag:graph>
     <diag:node id="a"><text style="font-size:12px">A</text></diag:node>
     <diag:anchor id="k" x="0" y="0"/>
   </diag:graph>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", bad_child])
-        self.assertEqual(code, 3)
-        self.assertIn("E_GRAPH_CHILD_UNSUPPORTED", err)
-
-        nested = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+"""),
+                "E_GRAPH_CHILD_UNSUPPORTED",
+            ),
+            (
+                "graph_nested",
+                _diag("""
   <diag:graph>
     <diag:node id="a"><text style="font-size:12px">A</text></diag:node>
     <diag:graph>
       <diag:node id="b"><text style="font-size:12px">B</text></diag:node>
     </diag:graph>
   </diag:graph>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", nested])
-        self.assertEqual(code, 3)
-        self.assertIn("E_GRAPH_NESTED_UNSUPPORTED", err)
+"""),
+                "E_GRAPH_NESTED_UNSUPPORTED",
+            ),
+        ]
+        for label, src, expected in cases:
+            with self.subTest(label):
+                code, _out, _png, err = self.run_compile(src)
+                self.assertEqual(code, 3)
+                self.assertIn(expected, err)
 
     def test_graph_in_flex_and_determinism(self) -> None:
-        with_graph = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        with_graph = _diag("""
   <diag:flex width="280" padding="10" gap="8">
     <diag:graph>
       <diag:node id="n1"><text style="font-size:12px">Node One</text></diag:node>
@@ -548,30 +597,21 @@ class CLIAcceptanceTests(unittest.TestCase):
     </diag:graph>
     <text style="font-size:12px">After graph</text>
   </diag:flex>
-</diag:diagram>
-""".strip()
-        no_graph = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+""")
+        no_graph = _diag("""
   <diag:flex width="280" padding="10" gap="8">
     <text style="font-size:12px">After graph</text>
   </diag:flex>
-</diag:diagram>
-""".strip()
-        code, out1, _png, err = self.run_cli(["compile", "--text", with_graph, "--stdout"])
-        self.assertEqual(code, 0, err)
-        code, out2, _png, err = self.run_cli(["compile", "--text", no_graph, "--stdout"])
-        self.assertEqual(code, 0, err)
-        root1 = ET.fromstring(out1)
-        root2 = ET.fromstring(out2)
-        self.assertGreater(float(root1.get("height")), float(root2.get("height")))
+""")
+        # Layout behaviour only; call the compiler directly rather than through argparse/stdio.
+        out1 = self.compile_svgpp(with_graph)
+        out2 = self.compile_svgpp(no_graph)
+        self.assertGreater(self._root_height(out1), self._root_height(out2))
 
-        code, repeat, _png, err = self.run_cli(["compile", "--text", with_graph, "--stdout"])
-        self.assertEqual(code, 0, err)
-        self.assertEqual(out1, repeat)
+        self.assertEqual(out1, self.compile_svgpp(with_graph))
 
     def test_wide_graph_does_not_stretch_fixed_width_flex_siblings(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <style>
     .hdr { fill:#f0f0f0; stroke:#777; stroke-width:1; }
     .node { fill:#eef; stroke:#66f; stroke-width:1; }
@@ -592,37 +632,24 @@ class CLIAcceptanceTests(unittest.TestCase):
       <diag:edge from="n4" to="n5"/>
     </diag:graph>
   </diag:flex>
-</diag:diagram>
-""".strip()
+""")
         with mock.patch("diagramagic.diagramagic.shutil.which", return_value=None):
-            code, out, _png, err = self.run_cli(["compile", "--text", src, "--stdout"])
+            code, out, _png, err = self.run_compile(src)
         self.assertEqual(code, 0, err)
         root = ET.fromstring(out)
-        hdr = root.find(".//{http://www.w3.org/2000/svg}g[@id='hdr']")
+        hdr = root.find(".//svg:g[@id='hdr']", _NS)
         self.assertIsNotNone(hdr)
-        rect = hdr.find(".//{http://www.w3.org/2000/svg}rect")
+        rect = hdr.find(".//svg:rect", _NS)
         self.assertIsNotNone(rect)
         self.assertAlmostEqual(float(rect.get("width")), 300.0, delta=0.001)
 
     def test_graph_too_large_error(self) -> None:
-        parts = [
-            '<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">',
-            "<diag:graph>",
-        ]
-        for i in range(2001):
-            parts.append(
-                f'<diag:node id="n{i}"><text style="font-size:12px">N{i}</text></diag:node>'
-            )
-        parts.append("</diag:graph>")
-        parts.append("</diag:diagram>")
-        src = "".join(parts)
-        code, _out, _png, err = self.run_cli(["compile", "--text", src])
+        code, _out, _png, err = self.run_compile(_TOO_LARGE_GRAPH_SRC)
         self.assertEqual(code, 3)
         self.assertIn("E_GRAPH_TOO_LARGE", err)
 
     def test_graph_wrap_uses_class_font_size_for_measurement(self) -> None:
-        with_class = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        with_class = _diag("""
   <style>
     .detail { font-size:10px; }
   </style>
@@ -631,143 +658,124 @@ class CLIAcceptanceTests(unittest.TestCase):
       <text class="detail" diag:wrap="true">Client sends request to host:port — TCP connection accepted by event loop</text>
     </diag:node>
   </diag:graph>
-</diag:diagram>
-""".strip()
-        without_class = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+""")
+        without_class = _diag("""
   <diag:graph>
     <diag:node id="http_req" width="220" padding="10">
       <text class="detail" diag:wrap="true">Client sends request to host:port — TCP connection accepted by event loop</text>
     </diag:node>
   </diag:graph>
-</diag:diagram>
-""".strip()
-        code, out1, _png, err = self.run_cli(["compile", "--text", with_class, "--stdout"])
+""")
+        code, out1, _png, err = self.run_compile(with_class)
         self.assertEqual(code, 0, err)
-        code, out2, _png, err = self.run_cli(["compile", "--text", without_class, "--stdout"])
+        code, out2, _png, err = self.run_compile(without_class)
         self.assertEqual(code, 0, err)
 
         root1 = ET.fromstring(out1)
         root2 = ET.fromstring(out2)
-        n1 = root1.find(".//{http://www.w3.org/2000/svg}g[@id='http_req']")
-        n2 = root2.find(".//{http://www.w3.org/2000/svg}g[@id='http_req']")
+        n1 = root1.find(".//svg:g[@id='http_req']", _NS)
+        n2 = root2.find(".//svg:g[@id='http_req']", _NS)
         self.assertIsNotNone(n1)
         self.assertIsNotNone(n2)
-        lines1 = n1.findall(".//{http://www.w3.org/2000/svg}tspan")
-        lines2 = n2.findall(".//{http://www.w3.org/2000/svg}tspan")
+        lines1 = n1.findall(".//svg:tspan", _NS)
+        lines2 = n2.findall(".//svg:tspan", _NS)
         self.assertLess(len(lines1), len(lines2))
 
     def test_graph_node_gap_controls_internal_spacing(self) -> None:
-        with_gap = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        with_gap = _diag("""
   <diag:graph>
     <diag:node id="n1" width="220" padding="10" gap="10" background-style="fill:#223;stroke:#99b;stroke-width:1">
       <text style="font-size:16px;font-weight:bold">Incoming HTTP Request</text>
       <text style="font-size:10px" diag:wrap="true">Client sends request to host:port — TCP connection accepted by event loop</text>
     </diag:node>
   </diag:graph>
-</diag:diagram>
-""".strip()
-        without_gap = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+""")
+        without_gap = _diag("""
   <diag:graph>
     <diag:node id="n1" width="220" padding="10" gap="0" background-style="fill:#223;stroke:#99b;stroke-width:1">
       <text style="font-size:16px;font-weight:bold">Incoming HTTP Request</text>
       <text style="font-size:10px" diag:wrap="true">Client sends request to host:port — TCP connection accepted by event loop</text>
     </diag:node>
   </diag:graph>
-</diag:diagram>
-""".strip()
-        code, out1, _png, err = self.run_cli(["compile", "--text", with_gap, "--stdout"])
+""")
+        code, out1, _png, err = self.run_compile(with_gap)
         self.assertEqual(code, 0, err)
-        code, out2, _png, err = self.run_cli(["compile", "--text", without_gap, "--stdout"])
+        code, out2, _png, err = self.run_compile(without_gap)
         self.assertEqual(code, 0, err)
 
         root1 = ET.fromstring(out1)
         root2 = ET.fromstring(out2)
-        n1 = root1.find(".//{http://www.w3.org/2000/svg}g[@id='n1']")
-        n2 = root2.find(".//{http://www.w3.org/2000/svg}g[@id='n1']")
+        n1 = root1.find(".//svg:g[@id='n1']", _NS)
+        n2 = root2.find(".//svg:g[@id='n1']", _NS)
         self.assertIsNotNone(n1)
         self.assertIsNotNone(n2)
-        h1 = float(n1.find(".//{http://www.w3.org/2000/svg}rect").get("height"))
-        h2 = float(n2.find(".//{http://www.w3.org/2000/svg}rect").get("height"))
+        h1 = float(n1.find(".//svg:rect", _NS).get("height"))
+        h2 = float(n2.find(".//svg:rect", _NS).get("height"))
         self.assertGreater(h1, h2)
 
     def test_graph_layout_attr_validation(self) -> None:
-        bad_layout = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        bad_layout = _diag("""
   <diag:graph layout="force">
     <diag:node id="a"><text style="font-size:12px">A</text></diag:node>
   </diag:graph>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", bad_layout])
+""")
+        code, _out, _png, err = self.run_compile(bad_layout)
         self.assertEqual(code, 3)
         self.assertIn("E_GRAPH_ARGS", err)
 
-        bad_routing = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        bad_routing = _diag("""
   <diag:graph routing="zigzag">
     <diag:node id="a"><text style="font-size:12px">A</text></diag:node>
   </diag:graph>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", bad_routing])
+""")
+        code, _out, _png, err = self.run_compile(bad_routing)
         self.assertEqual(code, 3)
         self.assertIn("E_GRAPH_ARGS", err)
 
-        bad_quality = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        bad_quality = _diag("""
   <diag:graph quality="ultra">
     <diag:node id="a"><text style="font-size:12px">A</text></diag:node>
   </diag:graph>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", bad_quality])
+""")
+        code, _out, _png, err = self.run_compile(bad_quality)
         self.assertEqual(code, 3)
         self.assertIn("E_GRAPH_ARGS", err)
 
     def test_graph_non_layered_requires_graphviz_when_missing(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <diag:graph layout="circular">
     <diag:node id="a"><text style="font-size:12px">A</text></diag:node>
     <diag:node id="b"><text style="font-size:12px">B</text></diag:node>
     <diag:edge from="a" to="b"/>
   </diag:graph>
-</diag:diagram>
-""".strip()
+""")
         with mock.patch("diagramagic.diagramagic.shutil.which", return_value=None):
-            code, _out, _png, err = self.run_cli(["compile", "--text", src])
+            code, _out, _png, err = self.run_compile(src)
         self.assertEqual(code, 3)
         self.assertIn("E_GRAPHVIZ_UNAVAILABLE", err)
 
     def test_graph_layered_falls_back_without_graphviz(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <diag:graph layout="layered" direction="TB">
     <diag:node id="a"><text style="font-size:12px">A</text></diag:node>
     <diag:node id="b"><text style="font-size:12px">B</text></diag:node>
     <diag:edge from="a" to="b"/>
   </diag:graph>
-</diag:diagram>
-""".strip()
+""")
         with mock.patch("diagramagic.diagramagic.shutil.which", return_value=None):
-            code, out, _png, err = self.run_cli(["compile", "--text", src, "--stdout"])
+            code, out, _png, err = self.run_compile(src)
         self.assertEqual(code, 0, err)
         root = ET.fromstring(out)
-        self.assertIsNotNone(root.find(".//{http://www.w3.org/2000/svg}path"))
+        self.assertIsNotNone(root.find(".//svg:path", _NS))
 
     def test_graph_circular_uses_graphviz_paths(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <diag:graph layout="circular" routing="polyline">
     <diag:node id="a"><text style="font-size:12px">A</text></diag:node>
     <diag:node id="b"><text style="font-size:12px">B</text></diag:node>
     <diag:edge from="a" to="b" label="ab"/>
   </diag:graph>
-</diag:diagram>
-""".strip()
+""")
         plain = "\n".join(
             [
                 "graph 1 4 3",
@@ -781,24 +789,22 @@ class CLIAcceptanceTests(unittest.TestCase):
         with mock.patch("diagramagic.diagramagic.shutil.which", return_value="/usr/bin/dot"), mock.patch(
             "diagramagic.diagramagic.subprocess.run", return_value=fake
         ):
-            code, out, _png, err = self.run_cli(["compile", "--text", src, "--stdout"])
+            code, out, _png, err = self.run_compile(src)
         self.assertEqual(code, 0, err)
         root = ET.fromstring(out)
-        paths = root.findall(".//{http://www.w3.org/2000/svg}path")
+        paths = root.findall(".//svg:path", _NS)
         self.assertTrue(any((p.get("d") or "").startswith("M ") for p in paths))
-        labels = root.findall(".//{http://www.w3.org/2000/svg}text")
+        labels = root.findall(".//svg:text", _NS)
         self.assertTrue(any((t.text or "").strip() == "ab" for t in labels))
 
     def test_graph_curved_routing_emits_bezier_path(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <diag:graph layout="layered" routing="curved" direction="TB">
     <diag:node id="a" padding="8" background-style="fill:#eef;stroke:#55f;stroke-width:1"><text style="font-size:12px">A</text></diag:node>
     <diag:node id="b" padding="8" background-style="fill:#eef;stroke:#55f;stroke-width:1"><text style="font-size:12px">B</text></diag:node>
     <diag:edge from="a" to="b"/>
   </diag:graph>
-</diag:diagram>
-""".strip()
+""")
         plain = "\n".join(
             [
                 "graph 1 4 3",
@@ -812,23 +818,21 @@ class CLIAcceptanceTests(unittest.TestCase):
         with mock.patch("diagramagic.diagramagic.shutil.which", return_value="/usr/bin/dot"), mock.patch(
             "diagramagic.diagramagic.subprocess.run", return_value=fake
         ):
-            code, out, _png, err = self.run_cli(["compile", "--text", src, "--stdout"])
+            code, out, _png, err = self.run_compile(src)
         self.assertEqual(code, 0, err)
         root = ET.fromstring(out)
-        path = root.find(".//{http://www.w3.org/2000/svg}path[@marker-end]")
+        path = root.find(".//svg:path[@marker-end]", _NS)
         self.assertIsNotNone(path)
         self.assertIn(" C ", path.get("d") or "")
 
     def test_graph_edge_endpoint_clips_to_target_border(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <diag:graph layout="circular" routing="polyline">
     <diag:node id="a" padding="8" background-style="fill:#eef;stroke:#55f;stroke-width:1"><text style="font-size:12px">A</text></diag:node>
     <diag:node id="b" padding="8" background-style="fill:#eef;stroke:#55f;stroke-width:1"><text style="font-size:12px">B</text></diag:node>
     <diag:edge from="a" to="b"/>
   </diag:graph>
-</diag:diagram>
-""".strip()
+""")
         plain = "\n".join(
             [
                 "graph 1 4 3",
@@ -842,22 +846,22 @@ class CLIAcceptanceTests(unittest.TestCase):
         with mock.patch("diagramagic.diagramagic.shutil.which", return_value="/usr/bin/dot"), mock.patch(
             "diagramagic.diagramagic.subprocess.run", return_value=fake
         ):
-            code, out, _png, err = self.run_cli(["compile", "--text", src, "--stdout"])
+            code, out, _png, err = self.run_compile(src)
         self.assertEqual(code, 0, err)
         root = ET.fromstring(out)
-        path = root.find(".//{http://www.w3.org/2000/svg}path[@marker-end]")
+        path = root.find(".//svg:path[@marker-end]", _NS)
         self.assertIsNotNone(path)
         d = path.get("d") or ""
-        nums = [float(v) for v in re.findall(r"-?\d+(?:\.\d+)?", d)]
+        nums = [float(v) for v in _NUMBER_RE.findall(d)]
         self.assertGreaterEqual(len(nums), 4)
         x_end, y_end = nums[-2], nums[-1]
 
-        b = root.find(".//{http://www.w3.org/2000/svg}g[@id='b']")
+        b = root.find(".//svg:g[@id='b']", _NS)
         self.assertIsNotNone(b)
-        m = re.search(r"translate\(([-0-9.]+),\s*([-0-9.]+)\)", b.get("transform") or "")
+        m = _TRANSLATE_XY_RE.search(b.get("transform") or "")
         self.assertIsNotNone(m)
         tx, ty = float(m.group(1)), float(m.group(2))
-        rect = b.find(".//{http://www.w3.org/2000/svg}rect")
+        rect = b.find(".//svg:rect", _NS)
         self.assertIsNotNone(rect)
         w = float(rect.get("width"))
         h = float(rect.get("height"))
@@ -870,18 +874,12 @@ class CLIAcceptanceTests(unittest.TestCase):
         self.assertTrue(on_left or on_right or on_top or on_bottom)
 
     def test_accepts_multiple_diag_namespace_uris(self) -> None:
-        with tempfile.TemporaryDirectory() as td:
-            src = Path(td) / "input.svg++"
-            src.write_text(
-                """
-<diag:diagram xmlns=\"http://www.w3.org/2000/svg\" xmlns:diag=\"https://diagramagic.ai/ns\">
+        src = _diag("""
   <diag:flex width=\"120\" padding=\"8\"><text style=\"font-size:12px\">Hello</text></diag:flex>
-</diag:diagram>
-""".strip()
-            )
-            code, _out, _png, err = self.run_cli(["compile", str(src)])
-            self.assertEqual(code, 0, err)
-            self.assertTrue((Path(td) / "input.svg").exists())
+""")
+        code, out, _png, err = self.run_compile(src)
+        self.assertEqual(code, 0, err)
+        self.assertIn("Hello", out)
 
     def test_error_format_json_shape(self) -> None:
         code, _out, _png, err = self.run_cli(["--error-format", "json"])
@@ -910,62 +908,36 @@ class CLIAcceptanceTests(unittest.TestCase):
             self.assertIn("Traceback", err)
 
     def test_g_bbox_participates_in_flex_height(self) -> None:
-        with tempfile.TemporaryDirectory() as td:
-            src = Path(td) / "g.svg++"
-            src.write_text(
-                """
-<diag:diagram xmlns=\"http://www.w3.org/2000/svg\" xmlns:diag=\"https://example.com/diag\">
+        src = _diag("""
   <diag:flex width=\"260\" padding=\"10\" gap=\"8\" background-class=\"box\">
     <g transform=\"scale(0.5)\">
       <rect x=\"0\" y=\"0\" width=\"300\" height=\"200\" fill=\"none\" stroke=\"#111\"/>
     </g>
     <text style=\"font-size:12px\">After group</text>
   </diag:flex>
-</diag:diagram>
-""".strip()
-            )
-            out = Path(td) / "g.svg"
-            code, _stdout, _png, err = self.run_cli(["compile", str(src), "-o", str(out)])
-            self.assertEqual(code, 0, err)
-            root = ET.fromstring(out.read_text())
-            rects = root.findall("{http://www.w3.org/2000/svg}rect")
-            # first rect is diagram background if any; the flex background should be present and tall enough
-            heights = [float(r.get("height", "0")) for r in rects]
-            self.assertTrue(any(h > 110 for h in heights), heights)
+""", ns=_EXAMPLE_DIAG_NS)
+        code, out, _png, err = self.run_compile(src)
+        self.assertEqual(code, 0, err)
+        root = ET.fromstring(out)
+        rects = root.findall("svg:rect", _NS)
+        # first rect is diagram background if any; the flex background should be present and tall enough
+        heights = [float(r.get("height", "0")) for r in rects]
+        self.assertTrue(any(h > 110 for h in heights), heights)
 
     def test_arrow_emits_line_and_label(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
-  <diag:flex id="a" x="20" y="20" width="120" padding="8"><text style="font-size:12px">A</text></diag:flex>
-  <diag:flex id="b" x="260" y="20" width="120" padding="8"><text style="font-size:12px">B</text></diag:flex>
-  <diag:arrow from="a" to="b" label="queries" stroke="#E67E22"/>
-</diag:diagram>
-""".strip()
-        code, out, _png, err = self.run_cli(["compile", "--text", src, "--stdout"])
+        src = _diag(_NODES_A_B + '  <diag:arrow from="a" to="b" label="queries" stroke="#E67E22"/>\n')
+        code, out, _png, err = self.run_compile(src)
         self.assertEqual(code, 0, err)
         root = ET.fromstring(out)
-        lines = root.findall(".//{http://www.w3.org/2000/svg}line")
+        lines = root.findall(".//svg:line", _NS)
         self.assertEqual(len(lines), 1)
         self.assertEqual(lines[0].get("stroke"), "#E67E22")
         self.assertTrue((lines[0].get("marker-end") or "").startswith("url(#diag-arrow-default"))
-        labels = root.findall(".//{http://www.w3.org/2000/svg}text")
+        labels = root.findall(".//svg:text", _NS)
         self.assertTrue(any((t.text or "").strip() == "queries" for t in labels))
 
-    def test_arrow_edge_overrides_are_rejected(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
-  <diag:flex id="top" x="40" y="20" width="120" padding="8"><text style="font-size:12px">Top</text></diag:flex>
-  <diag:flex id="bottom" x="40" y="220" width="120" padding="8"><text style="font-size:12px">Bottom</text></diag:flex>
-  <diag:arrow from="top" to="bottom" from-edge="bottom" to-edge="top" label="down"/>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", src])
-        self.assertEqual(code, 3)
-        self.assertIn("E_SVGPP_SEMANTIC", err)
-
     def test_arrow_marker_collision_policy(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <defs>
     <marker id="diag-arrow-default" markerWidth="6" markerHeight="6" refX="5" refY="3" orient="auto">
       <path d="M0,0 L6,3 L0,6 z" fill="#000"/>
@@ -974,75 +946,56 @@ class CLIAcceptanceTests(unittest.TestCase):
   <diag:flex id="a" x="20" y="20" width="120" padding="8"><text style="font-size:12px">A</text></diag:flex>
   <diag:flex id="b" x="260" y="20" width="120" padding="8"><text style="font-size:12px">B</text></diag:flex>
   <diag:arrow from="a" to="b"/>
-</diag:diagram>
-""".strip()
-        code, out, _png, err = self.run_cli(["compile", "--text", src, "--stdout"])
+""")
+        code, out, _png, err = self.run_compile(src)
         self.assertEqual(code, 0, err)
         root = ET.fromstring(out)
-        line = root.find(".//{http://www.w3.org/2000/svg}line")
+        line = root.find(".//svg:line", _NS)
         self.assertEqual(line.get("marker-end"), "url(#diag-arrow-default-1)")
-        markers = [m.get("id") for m in root.findall(".//{http://www.w3.org/2000/svg}marker")]
+        markers = [m.get("id") for m in root.findall(".//svg:marker", _NS)]
         self.assertIn("diag-arrow-default", markers)
         self.assertIn("diag-arrow-default-1", markers)
 
     def test_arrow_semantic_errors(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        # (label, svg++ source); every case exits with 3 and E_SVGPP_SEMANTIC.
+        cases = [
+            (
+                "missing_endpoint",
+                _diag("""
   <diag:flex id="a" x="20" y="20" width="120" padding="8"><text style="font-size:12px">A</text></diag:flex>
   <diag:arrow from="missing" to="a"/>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", src])
-        self.assertEqual(code, 3)
-        self.assertIn("E_SVGPP_SEMANTIC", err)
-
-        bad_edge = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
-  <diag:flex id="a" x="20" y="20" width="120" padding="8"><text style="font-size:12px">A</text></diag:flex>
-  <diag:flex id="b" x="260" y="20" width="120" padding="8"><text style="font-size:12px">B</text></diag:flex>
-  <diag:arrow from="a" to="b" from-edge="diagonal"/>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", bad_edge])
-        self.assertEqual(code, 3)
-        self.assertIn("E_SVGPP_SEMANTIC", err)
+"""),
+            ),
+            ("bad_edge", _diag(_NODES_A_B + '  <diag:arrow from="a" to="b" from-edge="diagonal"/>\n')),
+            (
+                "edge_overrides",
+                _diag("""
+  <diag:flex id="top" x="40" y="20" width="120" padding="8"><text style="font-size:12px">Top</text></diag:flex>
+  <diag:flex id="bottom" x="40" y="220" width="120" padding="8"><text style="font-size:12px">Bottom</text></diag:flex>
+  <diag:arrow from="top" to="bottom" from-edge="bottom" to-edge="top" label="down"/>
+"""),
+            ),
+        ]
+        for label, src in cases:
+            with self.subTest(label):
+                code, _out, _png, err = self.run_compile(src)
+                self.assertEqual(code, 3)
+                self.assertIn("E_SVGPP_SEMANTIC", err)
 
     def test_arrow_contributes_to_bounds(self) -> None:
-        no_arrow = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
-  <diag:flex id="a" x="20" y="20" width="120" padding="8"><text style="font-size:12px">A</text></diag:flex>
-  <diag:flex id="b" x="260" y="20" width="120" padding="8"><text style="font-size:12px">B</text></diag:flex>
-</diag:diagram>
-""".strip()
-        with_arrow = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
-  <diag:flex id="a" x="20" y="20" width="120" padding="8"><text style="font-size:12px">A</text></diag:flex>
-  <diag:flex id="b" x="260" y="20" width="120" padding="8"><text style="font-size:12px">B</text></diag:flex>
-  <diag:arrow from="a" to="b" stroke-width="24"/>
-</diag:diagram>
-""".strip()
-        code, out1, _png, err = self.run_cli(["compile", "--text", no_arrow, "--stdout"])
-        self.assertEqual(code, 0, err)
-        code, out2, _png, err = self.run_cli(["compile", "--text", with_arrow, "--stdout"])
-        self.assertEqual(code, 0, err)
-        root1 = ET.fromstring(out1)
-        root2 = ET.fromstring(out2)
-        h1 = float(root1.get("height"))
-        h2 = float(root2.get("height"))
+        h1, h2 = (self._root_height(self.compile_svgpp(src)) for src in (_ARROW_BOUNDS_WITHOUT, _ARROW_BOUNDS_WITH))
         self.assertGreater(h2, h1)
 
     def test_arrow_auto_uses_centerline_intersection(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <rect id="r1" x="0" y="0" width="100" height="100" fill="none" stroke="#111"/>
   <rect id="r2" x="200" y="0" width="100" height="100" fill="none" stroke="#111"/>
   <diag:arrow from="r1" to="r2" stroke="#111"/>
-</diag:diagram>
-""".strip()
-        code, out, _png, err = self.run_cli(["compile", "--text", src, "--stdout"])
+""")
+        code, out, _png, err = self.run_compile(src)
         self.assertEqual(code, 0, err)
         root = ET.fromstring(out)
-        line = root.find(".//{http://www.w3.org/2000/svg}line")
+        line = root.find(".//svg:line", _NS)
         self.assertIsNotNone(line)
         self.assertAlmostEqual(float(line.get("x1")), 100.5, delta=0.01)
         self.assertAlmostEqual(float(line.get("y1")), 50.0, delta=0.01)
@@ -1050,18 +1003,16 @@ class CLIAcceptanceTests(unittest.TestCase):
         self.assertAlmostEqual(float(line.get("y2")), 50.0, delta=0.01)
 
     def test_arrow_label_is_offset_and_not_upside_down(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <rect id="a" x="20" y="20" width="120" height="40" fill="none" stroke="#111"/>
   <rect id="b" x="260" y="20" width="120" height="40" fill="none" stroke="#111"/>
   <diag:arrow from="a" to="b" label="L2R"/>
   <diag:arrow from="b" to="a" label="R2L" stroke="#c2410c"/>
-</diag:diagram>
-""".strip()
-        code, out, _png, err = self.run_cli(["compile", "--text", src, "--stdout"])
+""")
+        code, out, _png, err = self.run_compile(src)
         self.assertEqual(code, 0, err)
         root = ET.fromstring(out)
-        labels = { (t.text or "").strip(): t for t in root.findall(".//{http://www.w3.org/2000/svg}text") if (t.text or "").strip() in {"L2R", "R2L"} }
+        labels = { (t.text or "").strip(): t for t in root.findall(".//svg:text", _NS) if (t.text or "").strip() in {"L2R", "R2L"} }
         self.assertEqual(set(labels.keys()), {"L2R", "R2L"})
 
         # Label should be offset above the connecting line (line midpoint y is 40).
@@ -1069,27 +1020,23 @@ class CLIAcceptanceTests(unittest.TestCase):
         self.assertLess(float(labels["R2L"].get("y")), 40.0)
 
         # Reversed arrow label should remain readable (no upside-down ~180deg rotation).
-        transform = labels["R2L"].get("transform", "")
-        if transform.startswith("rotate("):
-            angle_str = transform[len("rotate("):].split(" ", 1)[0]
-            angle = float(angle_str)
+        angle = _rotate_angle(labels["R2L"].get("transform"))
+        if angle is not None:
             self.assertLessEqual(abs(angle), 90.0)
 
     def test_arrow_label_rotate_modes(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <rect id="a" x="0" y="0" width="40" height="20"/>
   <rect id="b" x="120" y="80" width="40" height="20"/>
   <diag:arrow from="a" to="b" label="d0"/>
   <diag:arrow from="a" to="b" label="d1" label-rotate="follow" stroke="#f00"/>
   <diag:arrow from="a" to="b" label="d2" label-rotate="vertical" stroke="#0a0"/>
   <diag:arrow from="a" to="b" label="d3" label-rotate="45" stroke="#00f"/>
-</diag:diagram>
-""".strip()
-        code, out, _png, err = self.run_cli(["compile", "--text", src, "--stdout"])
+""")
+        code, out, _png, err = self.run_compile(src)
         self.assertEqual(code, 0, err)
         root = ET.fromstring(out)
-        labels = [t for t in root.findall(".//{http://www.w3.org/2000/svg}text") if (t.text or "").strip() in {"d0", "d1", "d2", "d3"}]
+        labels = [t for t in root.findall(".//svg:text", _NS) if (t.text or "").strip() in {"d0", "d1", "d2", "d3"}]
         by_text = {(t.text or "").strip(): t for t in labels}
         self.assertNotIn("transform", by_text["d0"].attrib)  # default horizontal
         self.assertIn("rotate(", by_text["d1"].get("transform", ""))  # follow
@@ -1097,36 +1044,32 @@ class CLIAcceptanceTests(unittest.TestCase):
         self.assertIn("rotate(45", by_text["d3"].get("transform", ""))  # explicit
 
     def test_arrow_label_rotate_invalid_value_errors(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <rect id="a" x="0" y="0" width="40" height="20"/>
   <rect id="b" x="120" y="80" width="40" height="20"/>
   <diag:arrow from="a" to="b" label="bad" label-rotate="diagonalish"/>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", src])
+""")
+        code, _out, _png, err = self.run_compile(src)
         self.assertEqual(code, 3)
         self.assertIn("E_SVGPP_SEMANTIC", err)
 
     def test_arrow_inside_transformed_group_uses_local_coords(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <g transform="scale(0.4)">
     <rect id="a" x="325" y="215" width="120" height="45" fill="none" stroke="#111"/>
     <rect id="b" x="325" y="290" width="120" height="45" fill="none" stroke="#111"/>
     <diag:arrow from="a" to="b" stroke="#555" stroke-width="1.2"/>
   </g>
-</diag:diagram>
-""".strip()
-        code, out, _png, err = self.run_cli(["compile", "--text", src, "--stdout"])
+""")
+        code, out, _png, err = self.run_compile(src)
         self.assertEqual(code, 0, err)
         root = ET.fromstring(out)
 
-        groups = root.findall("{http://www.w3.org/2000/svg}g")
+        groups = root.findall("svg:g", _NS)
         scaled = next((g for g in groups if g.get("transform") == "scale(0.4)"), None)
         self.assertIsNotNone(scaled)
 
-        line = scaled.find(".//{http://www.w3.org/2000/svg}line")
+        line = scaled.find(".//svg:line", _NS)
         self.assertIsNotNone(line)
         self.assertEqual(line.get("stroke"), "#555")
         self.assertEqual(line.get("stroke-width"), "1.2")
@@ -1135,21 +1078,19 @@ class CLIAcceptanceTests(unittest.TestCase):
         self.assertAlmostEqual(float(line.get("x2")), 385.0, delta=0.01)
         self.assertAlmostEqual(float(line.get("y2")), 289.5, delta=0.01)
 
-        top_level_lines = [child for child in list(root) if child.tag == "{http://www.w3.org/2000/svg}line"]
+        top_level_lines = root.findall("svg:line", _NS)
         self.assertEqual(top_level_lines, [])
 
     def test_arrow_accepts_absolute_anchor_endpoints(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <diag:anchor id="a1" x="40" y="80"/>
   <diag:anchor id="a2" x="220" y="80"/>
   <diag:arrow from="a1" to="a2" stroke="#111"/>
-</diag:diagram>
-""".strip()
-        code, out, _png, err = self.run_cli(["compile", "--text", src, "--stdout"])
+""")
+        code, out, _png, err = self.run_compile(src)
         self.assertEqual(code, 0, err)
         root = ET.fromstring(out)
-        line = root.find(".//{http://www.w3.org/2000/svg}line")
+        line = root.find(".//svg:line", _NS)
         self.assertIsNotNone(line)
         self.assertAlmostEqual(float(line.get("x1")), 40.0, delta=0.01)
         self.assertAlmostEqual(float(line.get("y1")), 80.0, delta=0.01)
@@ -1157,17 +1098,15 @@ class CLIAcceptanceTests(unittest.TestCase):
         self.assertAlmostEqual(float(line.get("y2")), 80.0, delta=0.01)
 
     def test_arrow_accepts_relative_anchor_and_mixed_endpoints(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <rect id="box" x="20" y="20" width="120" height="40" fill="none" stroke="#111"/>
   <diag:anchor id="right_mid" relative-to="box" side="right" offset-x="10"/>
   <diag:arrow from="box" to="right_mid" stroke="#111"/>
-</diag:diagram>
-""".strip()
-        code, out, _png, err = self.run_cli(["compile", "--text", src, "--stdout"])
+""")
+        code, out, _png, err = self.run_compile(src)
         self.assertEqual(code, 0, err)
         root = ET.fromstring(out)
-        line = root.find(".//{http://www.w3.org/2000/svg}line")
+        line = root.find(".//svg:line", _NS)
         self.assertIsNotNone(line)
         # relative-to right mid is (~140.5,40), then offset-x 10 => (~150.5,40)
         self.assertAlmostEqual(float(line.get("x2")), 150.5, delta=0.01)
@@ -1177,37 +1116,40 @@ class CLIAcceptanceTests(unittest.TestCase):
         self.assertAlmostEqual(float(line.get("y1")), 40.0, delta=0.01)
 
     def test_anchor_validation_and_target_errors(self) -> None:
-        missing_mode = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        missing_mode = _diag("""
   <diag:anchor id="a"/>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", missing_mode])
+""")
+        code, _out, _png, err = self.run_compile(missing_mode)
         self.assertEqual(code, 3)
         self.assertIn("E_SVGPP_SEMANTIC", err)
 
-        mixed_mode = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        mixed_mode = _diag("""
   <rect id="box" x="0" y="0" width="10" height="10"/>
   <diag:anchor id="a" x="10" y="10" relative-to="box"/>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", mixed_mode])
+""")
+        code, _out, _png, err = self.run_compile(mixed_mode)
         self.assertEqual(code, 3)
         self.assertIn("E_SVGPP_SEMANTIC", err)
 
-        missing_target = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        missing_target = _diag("""
   <diag:anchor id="a" relative-to="missing"/>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", missing_target])
+""")
+        code, _out, _png, err = self.run_compile(missing_target)
         self.assertEqual(code, 3)
         self.assertIn("E_SVGPP_SEMANTIC", err)
 
+        # Absolute anchors skip measurement but must still reject duplicate ids.
+        duplicate_ids = _diag("""
+  <rect id="dup" x="0" y="0" width="10" height="10"/>
+  <rect id="dup" x="20" y="0" width="10" height="10"/>
+  <diag:anchor id="a" x="5" y="5"/>
+""")
+        code, _out, _png, err = self.run_compile(duplicate_ids)
+        self.assertEqual(code, 3)
+        self.assertIn("duplicate id", err)
+
     def test_anchor_duplicate_ids_from_templates_are_rejected(self) -> None:
-        src = """
-<diag:diagram xmlns="http://www.w3.org/2000/svg" xmlns:diag="https://diagramagic.ai/ns">
+        src = _diag("""
   <diag:template name="lane">
     <diag:flex width="120" padding="8">
       <text style="font-size:12px">Lane</text>
@@ -1216,9 +1158,8 @@ class CLIAcceptanceTests(unittest.TestCase):
   </diag:template>
   <diag:instance template="lane" x="20" y="20"/>
   <diag:instance template="lane" x="220" y="20"/>
-</diag:diagram>
-""".strip()
-        code, _out, _png, err = self.run_cli(["compile", "--text", src])
+""")
+        code, _out, _png, err = self.run_compile(src)
         self.assertEqual(code, 3)
         self.assertIn("E_SVGPP_SEMANTIC", err)
 